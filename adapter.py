@@ -1,10 +1,103 @@
-import requests
+import asyncio
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pymongo import MongoClient, DESCENDING
-import numpy as np
 import math
-import logging
+import random
+import threading
+try:
+    import orjson as json
+except ImportError:
+    import json
+import time
+import numpy as np
+import metrics
+from readings import Readings
+
+'#client libraries (requests, aiohttp, pymongo) are imported by the adapters using them'
+'so that only the backend configured in config.ini is loaded at startup'
+
+'#shared by all blocking adapters, not owned by an event loop so that asyncio.run does not wait for timed out queries'
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="adapter")
+
+
+def adapter_from_config(config, section):
+    """
+    Creates the backend adapter configured in the given section of config.ini
+    :param config: ConfigParser
+    :param section: name of the section, i.e. "REST" or "MongoDB"
+    :return: Adapter
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("Connecting to {}".format(section))
+    if section == "MongoDB":
+        return MongoAdapter(config[section])
+    elif section == "MongoDB+SRV":
+        return MongoAdapterSRV(config[section])
+    elif section == "REST":
+        return RestAdapter(config[section])
+    elif section == "DexcomShare":
+        return DexcomShareAdapter(config[section])
+    elif section == "OFFLINE":
+        return OfflineAdapter(config[section])
+    elif section == "COMPOSITE":
+        sources = [s.strip() for s in config[section]["sources"].split(",")]
+        return CompositeAdapter([adapter_from_config(config, s) for s in sources],
+                                timeout=config[section].getfloat("timeout", 10))
+    else:
+        raise ValueError("config named {} does not exist".format(section))
+
+
+def iter_json_array(stream, chunk_size=64 * 1024):
+    """
+    Incrementally decodes the elements of a json array read from a file like stream.
+    Uses ijson if installed, otherwise decodes one element at a time with the standard library.
+    """
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+    if ijson is not None:
+        yield from ijson.items(stream, "item", use_float=True)
+        return
+
+    import json as std_json
+    import codecs
+    decoder = std_json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer, position, eof = "", 0, False
+    while True:
+        '#skip whitespace, the opening bracket and separators'
+        while position < len(buffer) and buffer[position] in " \t\r\n,[":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        element, end = None, None
+        if position < len(buffer):
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+        '#a number split after "." or "e" decodes early, an element is complete once followed by "," or "]"'
+        complete = end is not None
+        if complete and not eof:
+            following = end
+            while following < len(buffer) and buffer[following] in " \t\r\n":
+                following += 1
+            complete = following < len(buffer) and buffer[following] in ",]"
+        if not complete:
+            if eof:
+                return
+            chunk = stream.read(chunk_size)
+            eof = len(chunk) == 0
+            buffer = buffer[position:] + utf8.decode(chunk, final=eof)
+            position = 0
+            continue
+        position = end
+        yield element
+
 
 class Adapter:
     logger = logging.getLogger(__name__)
@@ -16,24 +109,190 @@ class Adapter:
 
         :param t_start: posix timestamp
         :param t_end:  posix timestamp
-        :return:
+        :return: Readings
+        """
+        return Readings(source=type(self).__name__)
+
+    def query_batches(self, t_start, t_end, batch_size=10000):
+        """
+        Variant of query for large ranges, adapters able to decode their response incrementally yield
+        Readings of at most batch_size readings. By default, the result of query is yielded as a single batch.
+        """
+        yield self.query(t_start, t_end)
+
+    async def aquery(self, t_start, t_end):
+        """
+        Asynchronous variant of query. Adapters without a native asyncio client
+        run their blocking query in a thread pool, see is_busy.
+        :param t_start: posix timestamp
+        :param t_end:  posix timestamp
+        :return: Readings
+        """
+        self.blocking_query = executor.submit(self.query, t_start, t_end)
+        return await asyncio.wrap_future(self.blocking_query, loop=asyncio.get_running_loop())
+
+    blocking_query = None
+
+    def is_busy(self):
+        """
+        Timed out queries can not be cancelled and keep running in the thread pool, until they return
+        the adapter is busy and should not be queried again.
+        """
+        return self.blocking_query is not None and not self.blocking_query.done()
+
+    def commit(self):
+        """
+        Called once the readings returned by the last query are stored. Adapters requesting only entries newer
+        than those seen before advance their state here, so readings lost before being stored are requested again.
         """
-        return []
+        pass
+
+    def start_tailing(self, callback):
+        """
+        Pushes new readings to callback as soon as they are inserted in the backend, instead of waiting
+        for the next query.
+        :param callback: called with Readings
+        :return: False if the adapter does not support tailing
+        """
+        return False
+
+    def is_tailing(self):
+        return False
+
+
+class CompositeAdapter(Adapter):
+    """
+    Fans out a query to several adapters concurrently and merges the results by timestamp.
+    Sources exceeding the timeout or failing are skipped, so a refresh takes as long as the
+    slowest responding source instead of the sum of all sources. Blocking sources still busy with a timed out
+    query are skipped until it returns, so hung sources do not take up the shared thread pool.
+    Readings of different sources closer than tolerance seconds are considered the same reading,
+    the source listed first wins.
+    """
+    def __init__(self, adapters, timeout=10, tolerance=60):
+        super().__init__()
+        self.logger = logging.getLogger(self.__module__)
+        self.adapters = adapters
+        self.timeout = timeout
+        self.tolerance = tolerance
+
+    def query(self, t_start, t_end):
+        return asyncio.run(self.aquery(t_start, t_end))
+
+    def commit(self):
+        for adapter in self.adapters:
+            adapter.commit()
+
+    async def aquery(self, t_start, t_end):
+        results = await asyncio.gather(*[self._aquery_source(adapter, t_start, t_end)
+                                         for adapter in self.adapters])
+        if all(result is None for result in results):
+            raise RuntimeError("none of the {} sources returned data".format(len(self.adapters)))
+
+        '#sources are merged in the order listed, a reading is dropped if a source listed before has one'
+        'within tolerance, readings of the same source are never merged'
+        kept, taken = [], np.empty(0, np.int64)
+        for readings in results:
+            if readings is None:
+                continue
+            if len(taken) > 0:
+                index = np.searchsorted(taken, readings.timestamps)
+                before = taken[np.maximum(index - 1, 0)]
+                after = taken[np.minimum(index, len(taken) - 1)]
+                distance = np.minimum(np.abs(readings.timestamps - before), np.abs(after - readings.timestamps))
+                readings = readings[distance >= self.tolerance * 1000]
+            kept.append(readings)
+            taken = np.sort(np.concatenate([taken, readings.timestamps]))
+        return Readings.concatenate(kept, source=type(self).__name__).sorted()
+
+    async def _aquery_source(self, adapter, t_start, t_end):
+        name = type(adapter).__name__
+        if adapter.is_busy():
+            '#a worker of the shared thread pool is still blocked by a previous query'
+            self.logger.warning("{} is still busy with a previous query, skipping".format(name))
+            metrics.ADAPTER_FETCH_ERRORS.inc(labels=name)
+            return None
+        t = time.perf_counter()
+        try:
+            readings = await asyncio.wait_for(adapter.aquery(t_start, t_end), timeout=self.timeout)
+            metrics.ADAPTER_FETCH_SECONDS.observe(time.perf_counter() - t, name)
+            metrics.ADAPTER_FETCH_ROWS.observe(len(readings), name)
+            return readings
+        except asyncio.TimeoutError:
+            self.logger.warning("{} did not respond within {} seconds, skipping".format(name, self.timeout))
+        except Exception:
+            self.logger.exception("error while querying {}, skipping".format(name))
+        metrics.ADAPTER_FETCH_ERRORS.inc(labels=name)
+        return None
+
+
 class DexcomShareAdapter(Adapter):
+    headers = {"Content-Type": "application/json",
+               "Content-Length": "0",
+               "Accept": "application/json",
+               "User-Agent": "test/0.1"}
+
     def __init__(self, params):
         super().__init__()
         self.logger = logging.getLogger(self.__module__)
         self.params = params
         self.url = 'https://shareous1.dexcom.com'
+        self.sessionID = None
 
-    def getSessionID(self):
-        temp = self.url + "/ShareWebServices/Services/General/LoginPublisherAccountByName"
-        body = {"accountName": self.params["user"],
+    def login_body(self):
+        return {"accountName": self.params["user"],
                 "applicationId": "d8665ade-9673-4e27-9ff6-92db4ce13d13",
                 "password": self.params["password"]}
+
+    @staticmethod
+    def glucose_params(session_id, t_start, t_end):
+        """the share api only serves the last 24 hours, one reading every 5 minutes"""
+        minutes = int(min(1440, max(1, math.ceil((t_end - t_start) / 60))))
+        return {"sessionID": session_id,
+                "minutes": str(minutes),
+                "maxCount": str(minutes // 5 + 1)}
+
+    def query(self, t_start, t_end):
+        import requests
+        if self.sessionID is None:
+            self.getSessionID()
+        try:
+            response = requests.post(
+                url=self.url + "/ShareWebServices/Services/Publisher/ReadPublisherLatestGlucoseValues",
+                params=DexcomShareAdapter.glucose_params(self.sessionID, t_start, t_end),
+                headers=DexcomShareAdapter.headers)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            '#session ids expire, request a new one with the next query'
+            self.sessionID = None
+            raise
+        return DexcomShareAdapter.dexcomToEntry(response.json()).between(t_start, t_end)
+
+    async def aquery(self, t_start, t_end):
+        import aiohttp
+        async with aiohttp.ClientSession(raise_for_status=True) as session:
+            try:
+                if self.sessionID is None:
+                    async with session.post(
+                            self.url + "/ShareWebServices/Services/General/LoginPublisherAccountByName",
+                            json=self.login_body()) as response:
+                        self.sessionID = (await response.text()).replace("\"", "")
+                async with session.post(
+                        self.url + "/ShareWebServices/Services/Publisher/ReadPublisherLatestGlucoseValues",
+                        params=DexcomShareAdapter.glucose_params(self.sessionID, t_start, t_end),
+                        headers=DexcomShareAdapter.headers) as response:
+                    payload = await response.json(content_type=None)
+            except aiohttp.ClientError:
+                self.sessionID = None
+                raise
+        return DexcomShareAdapter.dexcomToEntry(payload).between(t_start, t_end)
+
+    def getSessionID(self):
+        import requests
+        temp = self.url + "/ShareWebServices/Services/General/LoginPublisherAccountByName"
         self.sessionID = None
         try:
-            r = requests.post(temp, json=body)
+            r = requests.post(temp, json=self.login_body())
             r.raise_for_status()
             self.sessionID = r.text.replace("\"", "")
         except requests.exceptions.RequestException as err:
@@ -41,6 +300,7 @@ class DexcomShareAdapter(Adapter):
         return self.sessionID
 
     def getGlucose(self):
+        import requests
         data = None
         try:
             response = requests.post(
@@ -50,35 +310,43 @@ class DexcomShareAdapter(Adapter):
                     "minutes": "1440",
                     "maxCount": "1",
                 },
-                headers={
-                    "Content-Type": "application/json",
-                    "Content-Length": "0",
-                    "Accept": "application/json",
-                    "User-Agent": "test/0.1",
-                },
+                headers=DexcomShareAdapter.headers,
             )
-            print('Response HTTP Status Code: {status_code}'.format(
+            self.logger.debug('Response HTTP Status Code: {status_code}'.format(
                 status_code=response.status_code))
-            print('Response HTTP Response Body: {content}'.format(
+            self.logger.debug('Response HTTP Response Body: {content}'.format(
                 content=response.content))
             data = response.json()
         except requests.exceptions.RequestException:
-            print('HTTP Request failed')
+            self.logger.exception('HTTP Request failed')
         return data
 
+    @staticmethod
     def dexcomToEntry(payload_json):
         """[{DT: '/Date(1426292016000-0700)/',
           ST: '/Date(1426295616000)/',
           Trend: 4,
           Value: 101,
           WT: '/Date(1426292039000)/'}]"""
-        return [(datetime.fromtimestamp(int(re.findall(r'\d+', entry["WT"])[0])/1000),
-                 entry["Value"])
-                for entry in payload_json]
+        return Readings([int(re.findall(r'\d+', entry["WT"])[0]) for entry in payload_json],
+                        [entry["Value"] for entry in payload_json],
+                        trends=[DexcomShareAdapter.trend_code(entry.get("Trend", 0)) for entry in payload_json],
+                        source="DexcomShareAdapter")
+
+    trend_names = ["None", "DoubleUp", "SingleUp", "FortyFiveUp", "Flat", "FortyFiveDown", "SingleDown",
+                   "DoubleDown", "NotComputable", "RateOutOfRange"]
+
+    @staticmethod
+    def trend_code(trend):
+        """newer versions of the share api name the trend instead of sending its code"""
+        if isinstance(trend, str):
+            return DexcomShareAdapter.trend_names.index(trend) if trend in DexcomShareAdapter.trend_names else 0
+        return int(trend)
 
 class MongoAdapter(Adapter):
     def __init__(self, params):
         super().__init__()
+        from pymongo import MongoClient
         try:
             url = 'mongodb://{}:{}@{}:{}/{}'.format(params["user"], params["password"], params["host"], params["port"], params["database"])
             self.client = MongoClient(url, retryWrites=False)
@@ -91,20 +359,86 @@ class MongoAdapter(Adapter):
             exit()
 
     def query(self, t_start, t_end):
+        from pymongo import DESCENDING
         self.logger.info("querying entries between {} to {}".format(t_start, t_end))
 
         # query missing data
         entries = self.db[self.collection]
-        print(entries)
         self.logger.info("QUERYING    : {} - {}".format(datetime.fromtimestamp(t_start), datetime.fromtimestamp(t_end)))
         results = entries.find({"sgv": {"$gt": 0}, "date": {"$gte": t_start * 1000, "$lte": t_end * 1000}},
                                ["sgv", "date"], sort=[("date", DESCENDING)])
-        tuples = [(datetime.fromtimestamp(r["date"] / 1000), r["sgv"]) for r in results]
-        return tuples
+        return MongoAdapter.to_readings(list(results))
+
+    @staticmethod
+    def to_readings(documents):
+        return Readings([d["date"] for d in documents], [d["sgv"] for d in documents], source="MongoAdapter")
+
+    tail_thread = None
+
+    def start_tailing(self, callback, poll_interval=1):
+        self.tail_thread = threading.Thread(target=self.tail, args=(callback, poll_interval),
+                                            name="mongo-tail", daemon=True)
+        self.tail_thread.start()
+        return True
+
+    def is_tailing(self):
+        return self.tail_thread is not None and self.tail_thread.is_alive()
+
+    def tail(self, callback, poll_interval):
+        """
+        Follows inserts into the entries collection with a change stream. Change streams require a replica set,
+        on standalone deployments the collection is polled for documents newer than the latest date seen.
+        """
+        from pymongo import DESCENDING
+        from pymongo.errors import OperationFailure, PyMongoError
+        entries = self.db[self.collection]
+        latest = entries.find_one({"sgv": {"$gt": 0}}, ["date"], sort=[("date", DESCENDING)])
+        watermark = latest["date"] if latest is not None else 0
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.sgv": {"$gt": 0}}}]
+
+        resume_token = None
+        while True:
+            try:
+                with entries.watch(pipeline, resume_after=resume_token) as stream:
+                    self.logger.info("following {} with a change stream".format(self.collection))
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        document = change["fullDocument"]
+                        watermark = max(watermark, document["date"])
+                        callback(MongoAdapter.to_readings([document]))
+            except OperationFailure:
+                self.logger.info("change streams not supported, polling {} every {}s".format(self.collection,
+                                                                                            poll_interval))
+                break
+            except PyMongoError:
+                self.logger.exception("change stream interrupted, reconnecting ...")
+                time.sleep(poll_interval)
+            except Exception:
+                '#i.e. clients like mongomock without change stream support'
+                self.logger.exception("change stream failed, falling back to polling ...")
+                break
+
+        self.poll(entries, callback, watermark, poll_interval)
+
+    def poll(self, entries, callback, watermark, poll_interval):
+        from pymongo import ASCENDING
+        from pymongo.errors import PyMongoError
+        while True:
+            try:
+                results = entries.find({"sgv": {"$gt": 0}, "date": {"$gt": watermark}},
+                                       ["sgv", "date"], sort=[("date", ASCENDING)])
+                documents = list(results)
+                if len(documents) > 0:
+                    watermark = documents[-1]["date"]
+                    callback(MongoAdapter.to_readings(documents))
+            except PyMongoError:
+                self.logger.exception("error while polling for new entries")
+            time.sleep(poll_interval)
 
 
 class MongoAdapterSRV(MongoAdapter):
     def __init__(self, params):
+        from pymongo import MongoClient
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.ERROR)
         self.collection = params["collection"]
@@ -117,42 +451,199 @@ class MongoAdapterSRV(MongoAdapter):
             exit()
 
 class RestAdapter(Adapter):
+    '#ranges longer than this [s] are streamed by query_batches'
+    stream_threshold = 24 * 3600
+
     def __init__(self, params):
         super().__init__()
         self.logger = logging.getLogger(self.__module__)
-        self.url = 'https://{}:{}/api/v1/entries/sgv.json'.format(params["domain"], params["port"])
+        self.url = '{}://{}:{}/api/v1/entries/sgv.json'.format(params.get("protocol", "https"),
+                                                               params["domain"], params["port"])
+        self.session = None
+        '#date [ms] of the newest and the start of the oldest range returned so far'
+        self.newest_date = None
+        self.oldest_date = None
+        '#validators of the last response, sent along when the same url is requested again'
+        self.validated_params = None
+        self.etag = None
+        self.last_modified = None
+        '#state of the last response, applied once the caller commits'
+        self.pending_state = None
 
-    def query(self, t_start, t_end):
+    def query_params(self, t_start, t_end):
+        t_start_ms = int(t_start*1000)
+        open_ended = t_end >= time.time() - 60
+        if open_ended and self.newest_date is not None and self.oldest_date <= t_start_ms < self.newest_date:
+            '#everything up to the newest entry has been stored before'
+            t_start_ms = self.newest_date
         '# add count=100000 to circument some bad REST implementations'
         'which limit results even when specifying date range'
-        params = {"find[date][$gt]": int(t_start*1000),
-                  "find[date][$lt]": int(t_end*1000),
-                  "count": max(100000, 20*(t_end-t_start)/(60*60))}
-        response = requests.get(self.url, params=params)
-        tuples = [(datetime.fromtimestamp(j["date"] / 1000), #, timezone(timedelta(minutes=j["utcOffset"]))),
-                   j["sgv"]) for j in response.json()]
-        self.logger.info("queried {} tuples".format(len(tuples)))
-        return tuples
+        params = {"find[date][$gt]": t_start_ms,
+                  "count": int(max(100000, 20*(t_end-t_start_ms/1000)/(60*60)))}
+        '#queries up to now are left open ended, the url stays the same until new entries arrive'
+        'which lets the server answer with 304 not modified'
+        if not open_ended:
+            params["find[date][$lt]"] = int(t_end*1000)
+        return params
+
+    def conditional_headers(self, params):
+        headers = {}
+        if params == self.validated_params:
+            if self.etag is not None:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified is not None:
+                headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def update_state(self, params, headers, newest):
+        """
+        Remembers validators and newest entry of a response until commit.
+        :param newest: date [ms] of the newest entry in the response, None if it was empty
+        """
+        self.pending_state = (params, headers.get("ETag"), headers.get("Last-Modified"), newest)
+
+    def commit(self):
+        if self.pending_state is None:
+            return
+        params, self.etag, self.last_modified, newest = self.pending_state
+        self.pending_state = None
+        self.validated_params = params
+        t_start_ms = params["find[date][$gt]"]
+        self.oldest_date = t_start_ms if self.oldest_date is None else min(self.oldest_date, t_start_ms)
+        if newest is not None:
+            self.newest_date = newest if self.newest_date is None else max(self.newest_date, newest)
+
+    def to_readings(self, payload):
+        readings = Readings(np.fromiter((j["date"] for j in payload), dtype=np.int64, count=len(payload)),
+                            np.fromiter((j["sgv"] for j in payload), dtype=np.int16, count=len(payload)),
+                            source="RestAdapter")
+        self.logger.info("queried {} readings".format(len(readings)))
+        return readings
+
+    def get_session(self):
+        import requests
+        if self.session is None:
+            self.session = requests.Session()
+        return self.session
+
+    def query(self, t_start, t_end):
+        params = self.query_params(t_start, t_end)
+        response = self.get_session().get(self.url, params=params, headers=self.conditional_headers(params))
+        if response.status_code == 304:
+            self.logger.info("no new entries")
+            return Readings(source="RestAdapter")
+        response.raise_for_status()
+        readings = self.to_readings(json.loads(response.content))
+        self.update_state(params, response.headers, readings.newest())
+        return readings
+
+    def query_batches(self, t_start, t_end, batch_size=10000):
+        """
+        Streams the response of ranges longer than stream_threshold and decodes it entry by entry, memory stays
+        bounded by batch_size regardless of the queried range. Shorter ranges are fetched with query.
+        """
+        params = self.query_params(t_start, t_end)
+        if t_end - params["find[date][$gt]"] / 1000 <= RestAdapter.stream_threshold:
+            '#small ranges, i.e. the one minute updates, are decoded at once with the faster parser'
+            yield self.query(t_start, t_end)
+            return
+        with self.get_session().get(self.url, params=params, headers=self.conditional_headers(params),
+                                    stream=True) as response:
+            if response.status_code == 304:
+                self.logger.info("no new entries")
+                return
+            response.raise_for_status()
+            response.raw.decode_content = True
+
+            newest = None
+            dates, values, n = np.empty(batch_size, np.int64), np.empty(batch_size, np.int16), 0
+            for entry in iter_json_array(response.raw):
+                dates[n], values[n] = entry["date"], entry["sgv"]
+                n += 1
+                if n == batch_size:
+                    newest = max(newest or 0, int(dates.max()))
+                    yield Readings(dates, values, source="RestAdapter")
+                    dates, values, n = np.empty(batch_size, np.int64), np.empty(batch_size, np.int16), 0
+            if n > 0:
+                newest = max(newest or 0, int(dates[:n].max()))
+                yield Readings(dates[:n], values[:n], source="RestAdapter")
+            self.update_state(params, response.headers, newest)
+
+    async def aquery(self, t_start, t_end):
+        import aiohttp
+        params = self.query_params(t_start, t_end)
+        async with aiohttp.ClientSession(raise_for_status=True) as session:
+            async with session.get(self.url, params=params, headers=self.conditional_headers(params)) as response:
+                if response.status == 304:
+                    return Readings(source="RestAdapter")
+                readings = self.to_readings(json.loads(await response.read()))
+                self.update_state(params, response.headers, readings.newest())
+        return readings
 
 class OfflineAdapter(Adapter):
+    """
+    Simulated readings for development and load testing without a backend, see simulator.py.
+    Readings are deterministic for a given seed and patient. Optional parameters of the OFFLINE section:
+    seed, patient, interval [s], noise [mg/dl], gap_probability (per day), latency [s] and failure_rate (per query).
+    """
     @staticmethod
     def roundup(x, thresh):
         return int(math.ceil(x / thresh)) * thresh
 
-    def __init__(self):
+    def __init__(self, params=None):
         super().__init__()
         self.logger = logging.getLogger(self.__module__)
+        params = {} if params is None else params
+        self.seed = int(params.get("seed", 0))
+        self.patient = int(params.get("patient", 0))
+        self.interval = int(params.get("interval", 5*60))
+        self.noise = float(params.get("noise", 4))
+        self.gap_probability = float(params.get("gap_probability", 0.2))
+        self.latency = float(params.get("latency", 0))
+        self.failure_rate = float(params.get("failure_rate", 0))
+        '#latency and failures are drawn from a seeded sequence, the readings do not depend on it'
+        self.random = random.Random(self.seed)
 
     def query(self, t_start, t_end):
-        t0r = OfflineAdapter.roundup(t_start, 10*60)
-        t1r = OfflineAdapter.roundup(t_end, 10*60)
-
-        times = np.arange(t0r, t1r, 10*60)
-        glucose = 160 + np.sin(times*np.pi*2/(6*3600))*80# + np.random.rand(len(times))*20
-        datetimes = [datetime.fromtimestamp(t) for t in times]
-        tuples = list(zip(datetimes, glucose))
-        return tuples
-import re
+        self.inject_faults()
+        first, last = self.grid(t_start, t_end)
+        return self.simulate(first, last)
+
+    def query_batches(self, t_start, t_end, batch_size=10000):
+        self.inject_faults()
+        first, last = self.grid(t_start, t_end)
+        for start in range(first, last + 1, batch_size):
+            yield self.simulate(start, min(start + batch_size - 1, last))
+
+    def grid(self, t_start, t_end):
+        """:return: first and last index of the readings on the sampling grid between t_start and t_end"""
+        return OfflineAdapter.roundup(t_start, self.interval) // self.interval, int(t_end // self.interval)
+
+    def simulate(self, first, last):
+        import simulator
+        '#one reading before the first is simulated to derive its trend'
+        timestamps = np.arange(first - 1, last + 1, dtype=np.int64) * self.interval
+        offsets = OfflineAdapter.utc_offsets(timestamps)
+        glucose = simulator.glucose(timestamps, offsets, self.seed, self.patient, self.noise)
+        trends = simulator.trends(glucose, self.interval)
+        mask = simulator.available(timestamps[1:], offsets[1:], self.seed, self.patient, self.gap_probability)
+        return Readings(timestamps[1:][mask] * 1000, glucose[1:][mask], trends[mask], source="OfflineAdapter")
+
+    @staticmethod
+    def utc_offsets(timestamps):
+        """offset [s] of local time to utc, looked up once per day"""
+        if len(timestamps) == 0:
+            return np.zeros(0, dtype=np.int64)
+        days, index = np.unique(timestamps // 86400, return_inverse=True)
+        offsets = np.array([time.localtime(day * 86400 + 43200).tm_gmtoff for day in days.tolist()], dtype=np.int64)
+        return offsets[index]
+
+    def inject_faults(self):
+        if self.latency > 0:
+            time.sleep(self.latency * (0.5 + self.random.random()))
+        if self.random.random() < self.failure_rate:
+            raise ConnectionError("simulated backend failure")
+
 #re.findall(r'\d+', 'hello 42 I\'m a 32 string 30')
 #['42', '32', '30']
 
@@ -1,4 +1,4 @@
-from adapter import MongoAdapter, MongoAdapterSRV, RestAdapter, OfflineAdapter
+from adapter import adapter_from_config
 from database import DataBase, DATETIME_COLUMN, GLUCOSE_COLUMN
 from datetime import datetime, time, timedelta
 from configparser import ConfigParser
@@ -10,16 +10,7 @@ from configparser import ConfigParser
 config = ConfigParser()
 config.read('config.ini')
 section = config.sections()[0]
-if section == "MongoDB":
-    adapter = MongoAdapter(config["MongoDB"])
-if section == "MongoDB+SRV":
-    adapter = MongoAdapterSRV(config[section])
-elif section == "REST":
-    adapter = RestAdapter(config["REST"])
-elif section == "OFFLINE":
-    adapter = OfflineAdapter()
-else:
-    exit()
+adapter = adapter_from_config(config, section)
 
 x = adapter.query((datetime.now()-timedelta(days=7)).timestamp(), datetime.now().timestamp())
 print(x)
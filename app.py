@@ -2,15 +2,20 @@ import dash
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import plotly.graph_objs as go
+import plotly.utils
 
 import numpy as np
 import sys
 import cgm
+import flask
+import metrics
+import profiler
 from configparser import ConfigParser
 import logging
 
-from adapter import MongoAdapter, MongoAdapterSRV, RestAdapter, OfflineAdapter
+from adapter import adapter_from_config
 from database import DataBase, DATETIME_COLUMN, GLUCOSE_COLUMN
 from datetime import datetime, time, timedelta
 
@@ -18,7 +23,7 @@ from datetime import datetime, time, timedelta
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css',
                         'https://codepen.io/chriddyp/pen/bWLwgP.css']
 
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, compress=True)
 
 #create root logger
 
@@ -38,27 +43,62 @@ rootLogger.addHandler(fh)
 
 logger = logging.getLogger("app")
 
+if "-profile" in sys.argv:
+    profiler.enable(directory="profiles")
+
 
 #setup database and backend adapter
 config = ConfigParser()
 config.read('config.ini')
 section = config.sections()[0]
-if section == "MongoDB":
-    logger.info("Connecting to MongoDB")
-    adapter = MongoAdapter(config["MongoDB"])
-if section == "MongoDB+SRV":
-    logger.info("Connecting to MongoDB+SRV")
-    adapter = MongoAdapterSRV(config[section])
-elif section == "REST":
-    logger.info("Connecting to REST")
-    adapter = RestAdapter(config["REST"])
-elif section == "OFFLINE":
-    adapter = OfflineAdapter()
-else:
+try:
+    adapter = adapter_from_config(config, section)
+except ValueError:
     logger.error("config named {} does not exist, exiting ...".format(section))
     exit()
 
 database = DataBase(adapter)
+if config[section].getboolean("tail", True) and database.start_tailing():
+    logger.info("following new readings of {}".format(section))
+
+metrics.DATABASE_HISTORY_ROWS.set_function(lambda: len(database.df))
+metrics.DATA_STALENESS_SECONDS.set_function(
+    lambda: datetime.now().timestamp() - database.latest_query_time if database.latest_query_time != -1 else float("nan"))
+
+
+@app.server.route("/metrics")
+def metrics_route():
+    return flask.Response(metrics.exposition(), mimetype="text/plain; version=0.0.4")
+
+
+@app.server.after_request
+def measure_callback_response(response):
+    '#registered after flask-compress, therefore runs before it and sees the uncompressed size'
+    if flask.request.path.endswith("/_dash-update-component") and not response.direct_passthrough:
+        metrics.CALLBACK_RESPONSE_BYTES.observe(response.calculate_content_length() or 0)
+    return response
+
+
+def measure_compressed_response(response):
+    if flask.request.path.endswith("/_dash-update-component") and not response.direct_passthrough:
+        metrics.CALLBACK_RESPONSE_WIRE_BYTES.observe(response.calculate_content_length() or 0)
+    return response
+
+
+'#after request functions run in reverse order of registration, inserted first it runs after flask-compress'
+app.server.after_request_funcs.setdefault(None, []).insert(0, measure_compressed_response)
+
+
+class TimedPlotlyJSONEncoder(plotly.utils.PlotlyJSONEncoder):
+    """dash serializes callback responses with plotly.utils.PlotlyJSONEncoder, timed as the serialize stage"""
+    def encode(self, o):
+        if not (flask.has_request_context() and flask.request.path.endswith("/_dash-update-component")):
+            return super().encode(o)
+        with metrics.STAGE_SECONDS.time("serialize"):
+            return super().encode(o)
+
+
+plotly.utils.PlotlyJSONEncoder = TimedPlotlyJSONEncoder
 
 
 
@@ -87,12 +127,26 @@ def blank_graph(id, height):
             'displayModeBar': False
         })
 
+def hours_to_axis(hours):
+    """
+    The x axis is a date axis starting at 1970-01-01 00:00, so that plotly formats hover times client-side.
+    Positions are sent as integer milliseconds rounded to the minute.
+    """
+    return (np.round(np.asarray(hours, dtype=float) * 60) * 60000).astype(np.int64)
+
+
+def compact_glucose(values):
+    """rounds glucose values to integer mg/dl, keeping float only if gaps (nan) have to be sent"""
+    values = np.round(np.asarray(values, dtype=float))
+    return values.astype(np.int16) if np.isfinite(values).all() else values
+
+
 def fill_above(X, Ylow, Ytop, thresh_bottom, thresh_top):
     bottom1 = np.array([max(thresh_top, y) for y in Ylow])
     top1 = np.array([max(thresh_top, y) for y in Ytop])
 
     fill_top = go.Scatter(x=np.append(X, np.flip(X)),
-                          y=np.append(bottom1, np.flip(top1)),
+                          y=compact_glucose(np.append(bottom1, np.flip(top1))),
                           mode="lines", hoveron='fills', line=dict(width=0),
                           fillcolor=colors["signal"], fill='toself',
                           text="50th percentile", hoverinfo="text",
@@ -101,7 +155,7 @@ def fill_above(X, Ylow, Ytop, thresh_bottom, thresh_top):
     top2 = np.array([min(thresh_bottom, y) for y in Ytop])
     bottom2 = np.array([min(thresh_bottom, y) for y in Ylow])
     fill_bottom = go.Scatter(x=np.append(X, np.flip(X)),
-                             y=np.append(bottom2, np.flip(top2)),
+                             y=compact_glucose(np.append(bottom2, np.flip(top2))),
                              mode="lines", hoveron='fills', line=dict(width=0),
                              fillcolor=colors["signal"], fill='toself',
                              text="50th percentile", hoverinfo="text",
@@ -110,8 +164,9 @@ def fill_above(X, Ylow, Ytop, thresh_bottom, thresh_top):
 
 
 def agp_components(df, start=0):
-    stats = cgm.calculate_hourly_stats(df, datetime_column=DATETIME_COLUMN, glucose_column=GLUCOSE_COLUMN,
-                                       interpolated=True)
+    with metrics.STAGE_SECONDS.time("hourly_stats"):
+        stats = cgm.calculate_hourly_stats(df, datetime_column=DATETIME_COLUMN, glucose_column=GLUCOSE_COLUMN,
+                                           interpolated=True)
 
     index_copy = stats.index.values
     index_copy[index_copy < start] += 24
@@ -121,20 +176,21 @@ def agp_components(df, start=0):
     hours, p10, p25, p50, p75, p90 = stats.index.values, stats.glucose.p_10.values, stats.glucose.p_25.values, \
                                      stats.glucose.p_50.values, stats.glucose.p_75.values, stats.glucose.p_90.values
 
-    graphs = [go.Scatter(x=np.append(hours, np.flip(hours)),
-                         y=np.append(p10, np.flip(p90)),
+    x = hours_to_axis(hours)
+    graphs = [go.Scatter(x=np.append(x, np.flip(x)),
+                         y=compact_glucose(np.append(p10, np.flip(p90))),
                          mode="lines", hoveron='fills', line=dict(width=0),
                          fillcolor=colors["third"], fill='toself',
                          text="90th percentile", hoverinfo="text",
                          showlegend=False, ),
-              go.Scatter(x=np.append(hours, np.flip(hours)),
-                         y=np.append(p25, np.flip(p75)),
+              go.Scatter(x=np.append(x, np.flip(x)),
+                         y=compact_glucose(np.append(p25, np.flip(p75))),
                          mode="lines", hoveron='fills', line=dict(width=0),
                          fillcolor=colors["second"], fill='toself',
                          text="50th percentile", hoverinfo="text",
                          showlegend=False)]
-    graphs += fill_above(hours, p25, p75, 70, 180)
-    graphs += [go.Scatter(x=hours, y=p50, mode="lines", line=dict(width=5, color=colors["first"]),
+    graphs += fill_above(x, p25, p75, 70, 180)
+    graphs += [go.Scatter(x=x, y=compact_glucose(p50), mode="lines", line=dict(width=5, color=colors["first"]),
                           text="median", hoverinfo="y", hovertemplate='<br>%{y:3.0f} mg/dl', showlegend=False)]
     return graphs
 
@@ -150,19 +206,19 @@ def major_formatter(x):
 def scatter_graph(df, start=0, hover=True, mode='markers', size=7, color=None, edge=False):
     df = df.copy()
     df["hour"] = df[DATETIME_COLUMN].apply(lambda x: x.hour + x.minute / 60 + x.second / 3600)
-    df["glucose_smoothed"] = cgm.smooth_split(df[GLUCOSE_COLUMN].values, df[DATETIME_COLUMN].values, order=6)
+    with metrics.STAGE_SECONDS.time("smoothing"):
+        df["glucose_smoothed"] = cgm.smooth_split(df[GLUCOSE_COLUMN].values, df[DATETIME_COLUMN].values, order=6)
     # moves hours of current day in front of hours of previous day
     df.loc[df.hour < start, "hour"] = df[df.hour < start].hour + 24
 
-    scatter = go.Scatter(x=df.hour,
-                         y=df.glucose_smoothed,
-                         text=df[DATETIME_COLUMN].apply(lambda x: x.strftime("%H:%M")).values[:-1],
+    scatter = go.Scatter(x=hours_to_axis(df.hour.values),
+                         y=compact_glucose(df.glucose_smoothed.values),
                          marker=dict(size=size,
                                      color="#808080" if color is None else color,
                                      line=dict(color="white", width=3) if edge else None),
                          mode=mode,
-                         hoverinfo="y+text" if hover else 'none',
-                         hovertemplate='%{y:3.0f} mg/dl <br> %{text}' if hover else '',
+                         hoverinfo="x+y" if hover else 'none',
+                         hovertemplate='%{y:3.0f} mg/dl <br> %{x|%H:%M}' if hover else '',
                          showlegend=False)
     return scatter
 
@@ -230,9 +286,9 @@ def top_graph(df, show_today=True, show_days=True, show_grid=True, centered=Fals
     return {
         'data': graphs,
         'layout': go.Layout(
-            xaxis=dict(type='linear', zeroline=False, range=[start, end],
+            xaxis=dict(type='date', zeroline=False, range=hours_to_axis([start, end]),
                        ticktext=[major_formatter(x) for x in ticks], fixedrange=True,
-                       tickvals=ticks, gridcolor='#808080', showgrid=show_grid),
+                       tickvals=hours_to_axis(ticks), gridcolor='#808080', showgrid=show_grid),
             yaxis=dict(type='linear', zeroline=False, range=[40, ylim],  # title='glucose',
                        tickvals=[70, 180, 220], fixedrange=True,
                        ticktext=["70", "180", "220"], gridcolor='#808080', showgrid=show_grid),
@@ -246,13 +302,22 @@ def top_graph(df, show_today=True, show_days=True, show_grid=True, centered=Fals
     }
 
 
-def get_headline(latest):
+def variability_summary(variability):
+    if variability is None:
+        return ""
+    return "GMI {gmi:.1f}%  CV {cv:.0f}%  MAGE {mage:.0f}  LBGI {lbgi:.1f}  HBGI {hbgi:.1f}".format(**variability)
+
+
+def get_headline(latest, variability=None):
     if latest is not None:
         minutes = (datetime.now() - latest[DATETIME_COLUMN]).seconds / 60
 
         container = html.Div if minutes < 15 else html.Del
         color = colors["text"] if minutes < 15 else "#808080"
-        return html.Div(children=[container(" {:.0f} ".format(latest[GLUCOSE_COLUMN]),
+        return html.Div(children=[html.Div(variability_summary(variability),
+                                           style={'marginRight': 24, 'display': 'inline-block',
+                                                  "font-size": 18, 'color': "#808080"}),
+                                  container(" {:.0f} ".format(latest[GLUCOSE_COLUMN]),
                                             style={'display': 'inline-block', "font-size": 64, 'color': color}),
                                   html.Div("mg/dl".format(latest[GLUCOSE_COLUMN]),
                                            style={'marginLeft': 8, 'marginRight': 16, 'display': 'inline-block',
@@ -262,6 +327,10 @@ def get_headline(latest):
         return html.Div("???")
 
 
+SLIDER_DAYS = [7, 14, 30, 90, 365]
+
+variability = cgm.GlycemicVariability()
+
 app.layout = html.Div(style={"height": "100vh", "width": "100vw", 'backgroundColor': colors['background'],
                              'color': colors['text']}, children=[
 
@@ -288,35 +357,61 @@ app.layout = html.Div(style={"height": "100vh", "width": "100vw", 'backgroundCol
     # blank_graph(id="tir_bars", height="20vh"),
     dcc.Interval(id='update_tir_interval', interval=30 * 60 * 1000),
     dcc.Interval(id='update_agp_interval', interval=1 * 60 * 1000),
-    dcc.Interval(id='startup_interval', interval=1 * 1000, max_intervals=1)
+    dcc.Interval(id='startup_interval', interval=1 * 1000, max_intervals=1),
+    # while tailing, pushed readings are checked for every few seconds and refresh the graph right away
+    dcc.Interval(id='new_readings_interval', interval=2 * 1000, disabled=not database.adapter.is_tailing()),
+    dcc.Store(id='data_version'),
+    dcc.Store(id='rendered_version')
 ])
 
 
+@app.callback(Output('data_version', 'data'),
+              [Input('new_readings_interval', 'n_intervals')],
+              [State('rendered_version', 'data')])
+def check_new_readings_callback(n_intervals, rendered_version):
+    '#cheap check, the graph is only refreshed if readings were merged since it was rendered'
+    if n_intervals is None or rendered_version is None or database.version == rendered_version:
+        raise PreventUpdate
+    return database.version
+
+
 @app.callback([Output("top_graph", "figure"),
                Output("last_loaded_div", "children"),
-               Output('title', 'children')],
+               Output('title', 'children'),
+               Output('rendered_version', 'data')],
               [Input('update_agp_interval', 'n_intervals'),
                Input("startup_interval", "n_intervals"),
                Input('checkboxes', 'value'),
-               Input('day_slider', 'value')])
-def refresh_agp_graph_callback(n_interval_load, n_startup_interval, checkbox_values, slider_value):
-    num_days = [7, 14, 30, 90, 365][slider_value - 1]
+               Input('day_slider', 'value'),
+               Input('data_version', 'data')])
+@profiler.profiled(key=lambda n_interval_load, n_startup_interval, checkbox_values, slider_value, data_version:
+                   "refresh_agp_graph_callback_{}d".format(SLIDER_DAYS[slider_value - 1]))
+def refresh_agp_graph_callback(n_interval_load, n_startup_interval, checkbox_values, slider_value, data_version):
+    num_days = SLIDER_DAYS[slider_value - 1]
     last_loaded = "last refresh {}".format(datetime.now().strftime("%H:%M:%S"))
     start_datetime = datetime.now() - timedelta(days=num_days)
     df = database.get_entries(start_datetime, update=True)
+    version = database.version
     if df is None:
         logger.warning("didn't receive any data...")
         return [blank_graph(id='top_graph', height="85vh"),
                 "didn't receive any data,..."+last_loaded,
-                get_headline(None)]
+                get_headline(None),
+                version]
     else:
-        return [top_graph(df=df,
-                          show_today="show_today" in checkbox_values,
-                          show_days="show_days" in checkbox_values,
-                          show_grid="show_grid" in checkbox_values,
-                          centered="is_centered" in checkbox_values),
+        with metrics.STAGE_SECONDS.time("figure"):
+            figure = top_graph(df=df,
+                               show_today="show_today" in checkbox_values,
+                               show_days="show_days" in checkbox_values,
+                               show_grid="show_grid" in checkbox_values,
+                               centered="is_centered" in checkbox_values)
+        with metrics.STAGE_SECONDS.time("variability"):
+            variability.update(database.df, DATETIME_COLUMN, GLUCOSE_COLUMN)
+            summary = variability.window(start_datetime.date())
+        return [figure,
                 last_loaded,
-                get_headline(df.loc[df[DATETIME_COLUMN].idxmax()])]
+                get_headline(df.loc[df[DATETIME_COLUMN].idxmax()], summary),
+                version]
 
 
 """
@@ -354,4 +449,8 @@ if __name__ == '__main__':
         debug = True
     else:
         logger.info("starting application")
-    app.run_server(debug=debug, port=8080, host='0.0.0.0')
+    port = 8080
+    for arg in sys.argv:
+        if arg.startswith("-port="):
+            port = int(arg[len("-port="):])
+    app.run_server(debug=debug, port=port, host='0.0.0.0')
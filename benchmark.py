@@ -0,0 +1,147 @@
+"""
+Benchmarks for the dashboard, run from the repository root
+>python benchmark.py
+
+Runs against the OFFLINE adapter in a temporary directory, no backend credentials are needed.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def offline_environment():
+    """temporary working directory holding an OFFLINE config.ini, the repository is put on the python path"""
+    cwd = tempfile.mkdtemp(prefix="cgm-dash-bench-")
+    with open(os.path.join(cwd, "config.ini"), "w") as f:
+        f.write("[OFFLINE]\n")
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return cwd, env
+
+
+def parse_importtime(stderr):
+    """
+    Parses the output of python -X importtime
+    :return: List of tuples (module, self time [us], cumulative time [us], nesting level)
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), level))
+    return rows
+
+
+def profile_imports(module, top=10):
+    """
+    Measures the cold import time of module in a fresh interpreter
+    :return: (total time [s], list of the heaviest top level imports as (module, cumulative time [s]))
+    """
+    cwd, env = offline_environment()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+                            cwd=cwd, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                            universal_newlines=True)
+    rows = parse_importtime(result.stderr)
+    total = [cumulative for name, _, cumulative, level in rows if name == module and level == 0]
+    children = sorted([(name, cumulative / 1e6) for name, _, cumulative, level in rows if level == 1],
+                    key=lambda x: -x[1])
+    return (total[-1] / 1e6 if total else float("nan")), children[:top]
+
+
+def time_to_first_page():
+    """Seconds from interpreter start until app.py served its first page"""
+    cwd, env = offline_environment()
+    code = "import time; t = time.time(); import app; app.app.server.test_client().get('/'); print(time.time() - t)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, universal_newlines=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def offline_frame(days):
+    """glucose data of the last days as returned by DataBase.get_entries"""
+    from adapter import OfflineAdapter
+    from database import DataBase
+    from datetime import datetime, timedelta
+    start_datetime = datetime.now() - timedelta(days=days)
+    return DataBase(OfflineAdapter()).get_entries(start_datetime)
+
+
+def timeit(fun, repeat=20):
+    """median run time of fun in seconds"""
+    times = []
+    for i in range(repeat):
+        t = time.perf_counter()
+        fun()
+        times.append(time.perf_counter() - t)
+    return sorted(times)[len(times) // 2]
+
+
+def time_hourly_stats(days):
+    import cgm
+    from database import DATETIME_COLUMN, GLUCOSE_COLUMN
+    df = offline_frame(days)
+    return timeit(lambda: cgm.calculate_hourly_stats(df.copy(), DATETIME_COLUMN, GLUCOSE_COLUMN))
+
+
+def time_simulation(years, patients):
+    """seconds to simulate years of readings for each patient"""
+    from adapter import OfflineAdapter
+    t_end = time.time()
+    t_start = t_end - years * 365 * 24 * 3600
+    adapters = [OfflineAdapter({"patient": patient}) for patient in range(patients)]
+    return timeit(lambda: [sum(len(b) for b in adapter.query_batches(t_start, t_end)) for adapter in adapters],
+                  repeat=1)
+
+
+def import_app():
+    """imports app.py configured with the OFFLINE adapter"""
+    cwd, env = offline_environment()
+    os.chdir(cwd)
+    import app
+    return app
+
+
+def measure_figure(days):
+    """
+    Builds the figure the dashboard sends for the last days and serializes it like dash does
+    :return: (figure build time [s], serialization time [s], bytes, gzip compressed bytes)
+    """
+    import gzip
+    import json
+    import plotly
+    app = import_app()
+    df = offline_frame(days)
+    build = lambda: app.top_graph(df, show_today=True, show_days=True, show_grid=True, centered=True)
+    figure = build()
+    serialize = lambda: json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+    payload = serialize().encode("utf-8")
+    return timeit(build, repeat=5), timeit(serialize, repeat=5), len(payload), len(gzip.compress(payload))
+
+
+if __name__ == '__main__':
+    print("## import time")
+    for module in ["adapter", "database", "cgm", "app"]:
+        total, heaviest = profile_imports(module)
+        print("{:10s} {:7.3f}s  {}".format(module, total,
+                                          ", ".join("{} {:.3f}s".format(n, t) for n, t in heaviest[:5])))
+
+    print("## cold start")
+    print("first page served after {:.3f}s".format(time_to_first_page()))
+
+    print("## refresh")
+    for days in [7, 14, 30, 90, 365]:
+        print("{:3d}d  hourly stats {:6.1f}ms".format(days, time_hourly_stats(days) * 1e3))
+
+    print("## offline simulation")
+    print("10 years x 10 patients in {:.1f}s".format(time_simulation(10, 10)))
+
+    print("## figure (all days shown)")
+    for days in [7, 14, 30, 90, 365]:
+        build, serialize, size, compressed = measure_figure(days)
+        print("{:3d}d  build {:6.1f}ms  serialize {:6.1f}ms  {:8d} bytes  {:7d} bytes gzip".format(
+            days, build * 1e3, serialize * 1e3, size, compressed))
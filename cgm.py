@@ -1,13 +1,17 @@
+import threading
 import pandas as pd
 import numpy as np
-from scipy.interpolate import CubicSpline
+from functools import lru_cache
+from profiler import profiled
 
 
+@profiled()
 def fraction_ranges(s):
     calc = pd.cut(s, bins=[0, 70, 180, 1000], labels=["hypo", "range", "hyper"]).value_counts() / len(s)
     return calc.hypo, calc.range, calc.hyper
 
 
+@profiled()
 def agg_weekly(df):
     if df is not None:
         df["year"] = df.datetime.apply(lambda x: x.year)
@@ -21,6 +25,7 @@ def agg_weekly(df):
         return None
 
 
+@profiled()
 def calculate_hourly_stats(df, datetime_column, glucose_column, interpolated=True):
     def percentile(n):
         def percentile_(x):
@@ -45,7 +50,7 @@ def calculate_hourly_stats(df, datetime_column, glucose_column, interpolated=Tru
     stats = stats.append(first_row)
 
     if interpolated:
-        stats = stats.apply(lambda x: interpolate(x), axis=0)
+        stats = interpolate_frame(stats)
 
     return stats
 
@@ -62,6 +67,7 @@ def smooth(x, order=1):
     return x_new
 
 
+@profiled()
 def smooth_split(x, time, order):
     minutes = 15
     #assert datetimes are sorted in ascending order
@@ -73,7 +79,172 @@ def smooth_split(x, time, order):
 
 
 def interpolate(series):
-    fun = lambda x, y: CubicSpline(x, y, bc_type='periodic')
-    hours = np.linspace(0, 23.99, 200)
-    values = fun(series.index.values, series.values)(hours)
-    return pd.Series(data=values, index=hours, name=series.name)
\ No newline at end of file
+    return interpolate_frame(series.to_frame())[series.name]
+
+
+@profiled()
+def interpolate_frame(frame):
+    """
+    Interpolates all columns of frame with a periodic cubic spline on 200 points between 0 and 23.99 hours
+    :param frame: DataFrame indexed by the knots, the last row closes the period and equals the first row
+    :return: DataFrame with the same columns indexed by hours
+    """
+    values = np.ascontiguousarray(frame.values, dtype=float)
+    hours, interpolated = _interpolate_values(tuple(frame.index.values.astype(float)), values.tobytes(), values.shape)
+    return pd.DataFrame(data=interpolated.copy(), index=hours.copy(), columns=frame.columns)
+
+
+@lru_cache(maxsize=16)
+def _interpolate_values(knots, values_bytes, shape):
+    """cached on the binned values, refreshes without new readings in the window skip the interpolation"""
+    values = np.frombuffer(values_bytes).reshape(shape)
+    hours, matrix = periodic_spline_matrix(knots)
+    result = matrix @ values[:-1]
+    result.flags.writeable = False
+    return hours, result
+
+
+@lru_cache(maxsize=4)
+def periodic_spline_matrix(knots, num=200):
+    """
+    A cubic spline is linear in the values it interpolates. Fitting it once to the unit vectors gives a matrix
+    that evaluates the spline through any values on the same knots with a single matrix multiplication.
+    :param knots: tuple of x values, the last knot closes the period
+    :return: (hours, matrix of shape (num, len(knots) - 1))
+    """
+    '#scipy is slow to import and only needed once the first AGP is drawn'
+    from scipy.interpolate import CubicSpline
+    n = len(knots) - 1
+    basis = np.vstack([np.eye(n), np.eye(n)[:1]])
+    hours = np.linspace(0, 23.99, num)
+    matrix = CubicSpline(np.array(knots), basis, bc_type='periodic')(hours)
+    hours.flags.writeable = False
+    matrix.flags.writeable = False
+    return hours, matrix
+
+
+def risk_indices(glucose):
+    """
+    Low and high blood glucose risk of each reading (Kovatchev), their means are LBGI and HBGI
+    :param glucose: array of glucose values in mg/dl
+    :return: (low risk array, high risk array)
+    """
+    f = 1.509 * (np.log(np.maximum(glucose, 1)) ** 1.084 - 5.381)
+    risk = 10 * f ** 2
+    return np.where(f < 0, risk, 0.0), np.where(f > 0, risk, 0.0)
+
+
+def turning_points(x):
+    """indices of the local minima and maxima of x, plateaus count once"""
+    d = np.diff(x)
+    moving = np.nonzero(d)[0]
+    direction_changes = np.nonzero(np.diff(np.sign(d[moving])))[0]
+    return moving[direction_changes + 1]
+
+
+def excursion_amplitudes(points, threshold):
+    """
+    Amplitudes of the excursions between turning points as counted by MAGE, swings smaller than threshold
+    are merged into the surrounding excursion instead of splitting it.
+    :param points: glucose values at alternating turning points
+    :return: array of amplitudes, each at least threshold
+    """
+    amplitudes = []
+    if len(points) == 0:
+        return np.array(amplitudes)
+    '#until the first excursion is confirmed, its start may be the lowest or the highest point so far'
+    low = high = points[0]
+    anchor, extreme, direction = None, None, 0
+    for value in points[1:].tolist():
+        if direction == 0:
+            low, high = min(low, value), max(high, value)
+            if value - low >= threshold:
+                anchor, extreme, direction = low, value, 1
+            elif high - value >= threshold:
+                anchor, extreme, direction = high, value, -1
+        elif (value - extreme) * direction > 0:
+            extreme = value
+        elif (extreme - value) * direction >= threshold:
+            amplitudes.append(abs(extreme - anchor))
+            anchor, extreme, direction = extreme, value, -direction
+    if direction != 0 and abs(extreme - anchor) >= threshold:
+        amplitudes.append(abs(extreme - anchor))
+    return np.array(amplitudes)
+
+
+class GlycemicVariability:
+    """
+    Glycemic variability of a window of days (GMI, CV, MAGE, LBGI and HBGI) at O(days) cost.
+    Per day, the number of readings, the sums of glucose, glucose squared and both risks as well as
+    the turning points of the smoothed glucose are kept. MAGE depends on the sd of the window and is
+    computed from the turning points of the selected days.
+    Only days with new readings and the day before the last one are recomputed on update, window metrics
+    are composed from the partials of whole days.
+    """
+    def __init__(self):
+        '#day (numpy datetime64[D]) -> (n, sum, sum of squares, low risk sum, high risk sum, turning point values)'
+        self.partials = {}
+        self.open_day = None
+        '#the dashboard callbacks update and read concurrently'
+        self.lock = threading.Lock()
+
+    @profiled()
+    def update(self, df, datetime_column, glucose_column):
+        if df is None or len(df) == 0:
+            return
+        with self.lock:
+            self._update(df, datetime_column, glucose_column)
+
+    def _update(self, df, datetime_column, glucose_column):
+        times = df[datetime_column].values
+        all_days, counts = np.unique(times.astype("datetime64[D]"), return_counts=True)
+        '#days whose number of readings changed received new readings, i.e. backfilled by a reconnecting uploader'
+        changed = [day for day, count in zip(all_days, counts) if self.partials.get(day, (0,))[0] != count]
+        if len(changed) == 0:
+            return
+        recompute_from = changed[0] if self.open_day is None else min(changed[0], self.open_day - 1)
+
+        '#the day before is smoothed along so that excursions crossing into the recomputed days are kept'
+        rows = times >= recompute_from - 1
+        order = np.argsort(times[rows], kind="stable")
+        times = times[rows][order]
+        glucose = df[glucose_column].values[rows][order].astype(float)
+        days, day_index = np.unique(times.astype("datetime64[D]"), return_inverse=True)
+
+        low, high = risk_indices(glucose)
+        sums = [np.bincount(day_index, weights=w, minlength=len(days))
+                for w in (np.ones_like(glucose), glucose, glucose ** 2, low, high)]
+
+        smoothed = smooth_split(glucose, times, order=6)
+        points = turning_points(smoothed)
+        splits = np.searchsorted(day_index[points], np.arange(1, len(days)))
+        day_points = np.split(smoothed[points], splits)
+
+        for i, day in enumerate(days):
+            if day >= recompute_from:
+                self.partials[day] = tuple(s[i] for s in sums) + (day_points[i],)
+        self.open_day = days[-1]
+
+    def window(self, start_date):
+        """
+        :param start_date: datetime.date of the first day in the window
+        :return: dict with gmi [%], cv [%], mean, sd and mage [mg/dl], lbgi and hbgi or None without readings
+        """
+        start = np.datetime64(start_date, "D")
+        with self.lock:
+            selected = [partial for day, partial in sorted(self.partials.items()) if day >= start]
+        if len(selected) == 0:
+            return None
+        n, total, squares, low, high = (sum(p[i] for p in selected) for i in range(5))
+        if n == 0:
+            return None
+        mean = total / n
+        sd = np.sqrt(max(squares / n - mean ** 2, 0))
+        amplitudes = excursion_amplitudes(np.concatenate([p[5] for p in selected]), sd)
+        return {"mean": mean,
+                "sd": sd,
+                "gmi": 3.31 + 0.02392 * mean,
+                "cv": 100 * sd / mean,
+                "mage": amplitudes.mean() if len(amplitudes) > 0 else 0.0,
+                "lbgi": low / n,
+                "hbgi": high / n}
@@ -0,0 +1,280 @@
+"""
+Consistency checks running without a backend, run from the repository root
+>python checks.py
+
+The mongo checks use mongomock as stand-in for the database.
+"""
+import time
+from datetime import datetime, timedelta
+
+
+def check_mongo_tailing():
+    """readings inserted into mongo are pushed to the database, which stops querying while the adapter tails"""
+    import mongomock
+    from adapter import MongoAdapter
+    from database import DataBase, GLUCOSE_COLUMN
+
+    with mongomock.patch(servers=(("localhost", 27017),)):
+        adapter = MongoAdapter({"user": "user", "password": "password", "host": "localhost", "port": 27017,
+                                "database": "nightscout", "collection": "entries"})
+    entries = adapter.db[adapter.collection]
+    now = time.time()
+    entries.insert_many([{"date": int((now - i * 300) * 1000), "sgv": 100 + i, "type": "sgv"} for i in range(1, 13)])
+
+    queries = []
+    query = adapter.query
+    adapter.query = lambda t_start, t_end: queries.append((t_start, t_end)) or query(t_start, t_end)
+
+    database = DataBase(adapter)
+    assert len(database.get_entries(datetime.now() - timedelta(hours=2))) == 12
+    assert len(queries) == 1
+    assert database.start_tailing()
+
+    entries.insert_one({"date": int(time.time() * 1000), "sgv": 250, "type": "sgv"})
+    deadline = time.time() + 10
+    while 250 not in database.df[GLUCOSE_COLUMN].tolist():
+        assert time.time() < deadline, "inserted reading was not pushed to the database"
+        time.sleep(0.1)
+    assert adapter.is_tailing()
+
+    '#without tailing, the reading time more than a minute in the past would trigger a query'
+    database.latest_query_time -= 5 * 60
+    assert len(database.get_entries(datetime.now() - timedelta(hours=2))) == 13
+    assert len(queries) == 1, "queried although the adapter is tailing"
+
+
+def check_variability_incremental():
+    """incremental updates of GlycemicVariability, including backfilled days, match a full recompute"""
+    import numpy as np
+    import pandas as pd
+    from adapter import OfflineAdapter
+    from cgm import GlycemicVariability
+    from database import to_frame, DATETIME_COLUMN, GLUCOSE_COLUMN
+
+    now = time.time()
+    frame = to_frame(OfflineAdapter().query(now - 30 * 86400, now))
+    times = frame[DATETIME_COLUMN]
+    '#an uploader offline for the last hours of day 25, its readings arrive after the day is closed'
+    offline = (times >= times.min() + pd.Timedelta(days=25, hours=-6)) & (times < times.min() + pd.Timedelta(days=26))
+
+    incremental = GlycemicVariability()
+    received = frame[~offline & (times < times.min() + pd.Timedelta(days=20))]
+    incremental.update(received, DATETIME_COLUMN, GLUCOSE_COLUMN)
+    for hours in range(20 * 24, 31 * 24, 7):
+        new = ~offline & (times < times.min() + pd.Timedelta(hours=hours))
+        received = pd.concat([received, frame[new]]).drop_duplicates()
+        incremental.update(received, DATETIME_COLUMN, GLUCOSE_COLUMN)
+    received = pd.concat([received, frame[offline]]).drop_duplicates()
+    incremental.update(received, DATETIME_COLUMN, GLUCOSE_COLUMN)
+
+    full = GlycemicVariability()
+    full.update(frame, DATETIME_COLUMN, GLUCOSE_COLUMN)
+    for days in (1, 5, 14, 30):
+        start_date = (datetime.now() - timedelta(days=days)).date()
+        expected, actual = full.window(start_date), incremental.window(start_date)
+        for key in expected:
+            assert np.isclose(expected[key], actual[key]), "{} of {} days: {} != {}".format(
+                key, days, actual[key], expected[key])
+
+
+
+def check_composite_merge():
+    """
+    readings of a lower priority source are dropped only next to readings of a source listed before,
+    slow sources are skipped after the timeout and while their query is still running
+    """
+    import numpy as np
+    from adapter import Adapter, CompositeAdapter, OfflineAdapter
+    from readings import Readings
+
+    class Fixed(Adapter):
+        def __init__(self, readings):
+            super().__init__()
+            self.readings = readings
+
+        def query(self, t_start, t_end):
+            return self.readings
+
+    t0 = int(time.time() - 3600) * 1000
+    '#one minute sources with jitter, readings of the same source are never merged'
+    first = Readings(t0 + np.arange(20) * 50000, np.full(20, 100))
+    second = Readings(t0 + np.arange(20) * 50000 + 10000, np.full(20, 200))
+    assert len(CompositeAdapter([Fixed(first)]).query(0, time.time())) == 20
+    merged = CompositeAdapter([Fixed(second), Fixed(first)], tolerance=60).query(0, time.time())
+    assert len(merged) == 20 and set(merged.glucose.tolist()) == {200}
+    '#readings 150s apart are not within tolerance, both are kept'
+    interleaved = Readings(t0 + np.arange(20) * 300000 + 150000, np.full(20, 300))
+    merged = CompositeAdapter([Fixed(Readings(t0 + np.arange(20) * 300000, np.full(20, 100))),
+                               Fixed(interleaved)], tolerance=60).query(0, time.time())
+    assert len(merged) == 40 and np.all(np.diff(merged.timestamps) > 0)
+
+    slow = OfflineAdapter({"latency": 4})
+    composite = CompositeAdapter([slow, Fixed(first)], timeout=0.5)
+    t = time.perf_counter()
+    assert len(composite.query(0, time.time())) == 20
+    assert time.perf_counter() - t < 1, "waited for the slow source"
+    assert slow.is_busy()
+    '#the slow source is still running in the thread pool and is skipped without waiting for the timeout'
+    t = time.perf_counter()
+    assert len(composite.query(0, time.time())) == 20
+    assert time.perf_counter() - t < 0.25, "queried the busy source again"
+
+
+
+def check_rest_conditional():
+    """
+    against the nightscout stub, the RestAdapter resumes after the newest committed entry, answers idle updates
+    with 304, leaves closed windows alone and requests readings again that were not stored
+    """
+    import numpy as np
+    from adapter import Adapter, RestAdapter
+    from database import DataBase, GLUCOSE_COLUMN
+    from helper.nightscout_stub import NightscoutStub
+    from readings import Readings
+
+    class Growing(Adapter):
+        def __init__(self, readings):
+            super().__init__()
+            self.readings = readings
+
+        def query(self, t_start, t_end):
+            return self.readings
+
+        def append(self, glucose):
+            self.readings = Readings.concatenate([self.readings, Readings([int(time.time() * 1000)], [glucose])])
+
+    now = time.time()
+    backend = Growing(Readings(int((now - 3600) * 1000) + np.arange(12) * 300000, 100 + np.arange(12)))
+    stub = NightscoutStub(adapter=backend, port=0).start()
+    try:
+        rest = RestAdapter({"protocol": "http", "domain": "localhost", "port": stub.port})
+        assert len(rest.query(now - 7200, time.time())) == 12
+        rest.commit()
+        newest = rest.newest_date
+        assert newest == backend.readings.newest()
+
+        '#the first idle update validates the resumed url, the next ones are not modified'
+        assert len(rest.query(now - 7200, time.time())) == 0
+        rest.commit()
+        bytes_sent = stub.bytes_sent
+        assert len(rest.query(now - 7200, time.time())) == 0
+        assert stub.requests.get(304) == 1 and stub.bytes_sent == bytes_sent
+
+        '#a new entry is fetched once, starting after the newest entry'
+        backend.append(250)
+        assert rest.query_params(now - 7200, time.time())["find[date][$gt]"] == newest
+        assert rest.query(now - 7200, time.time()).glucose.tolist() == [250]
+        rest.commit()
+        assert len(rest.query(now - 7200, time.time())) == 0
+
+        '#closed windows in the fetched range are not clamped'
+        assert "find[date][$lt]" in rest.query_params(now - 3600, now - 1800)
+        assert len(rest.query(now - 3600 - 1, now - 1800 + 1)) == 7
+
+        '#readings lost to a failing merge are not committed and requested again'
+        database = DataBase(rest)
+        assert database.update_entries(datetime.fromtimestamp(now - 7200))
+        backend.append(300)
+        merge = database.merge
+
+        def failing_merge(frames):
+            raise MemoryError("merge failed")
+        database.merge = failing_merge
+        newest = rest.newest_date
+        assert not database.update_entries(datetime.fromtimestamp(now - 7200))
+        assert rest.newest_date == newest
+        database.merge = merge
+        assert database.update_entries(datetime.fromtimestamp(now - 7200))
+        assert 300 in database.df[GLUCOSE_COLUMN].tolist()
+    finally:
+        stub.stop()
+
+
+
+def check_json_stream():
+    """iter_json_array decodes arrays split into small chunks like json.loads, with and without ijson"""
+    import io
+    import json
+    import sys
+    from adapter import iter_json_array
+
+    entries = [{"_id": "5e8f{:020x}".format(i), "date": 1586000000000 + i * 300000, "dateString": "2020-04-04T12:00Z",
+                "sgv": 100 + i, "delta": -1.5e-1 * i, "direction": "Flat", "device": "xDrip-DexcomG6 \u00e9",
+                "noise": 1, "filtered": 1.25e5, "rssi": 100.0} for i in range(20)]
+    payloads = [json.dumps(entries), json.dumps(entries, indent=2), "[1.5, 2e10, -0.25E-3 , 7 ]", "[]"]
+    ijson = sys.modules.get("ijson")
+    for parser in ("ijson", "fallback"):
+        if parser == "fallback":
+            '#imports of a module set to None in sys.modules raise ImportError'
+            sys.modules["ijson"] = None
+        try:
+            for payload in payloads:
+                for chunk_size in (1, 2, 3, 5, 7, 64):
+                    stream = io.BytesIO(payload.encode("utf-8"))
+                    decoded = list(iter_json_array(stream, chunk_size=chunk_size))
+                    assert decoded == json.loads(payload), "{} with chunks of {}".format(parser, chunk_size)
+        finally:
+            if ijson is None:
+                sys.modules.pop("ijson", None)
+            else:
+                sys.modules["ijson"] = ijson
+
+
+def check_rest_batches():
+    """RestAdapter.query_batches returns the same readings as query, streamed or not"""
+    import numpy as np
+    from adapter import RestAdapter
+    from helper.nightscout_stub import NightscoutStub
+    from readings import Readings
+
+    stub = NightscoutStub(port=0).start()
+    try:
+        now = time.time()
+        for days in (0.5, 3):
+            t_start, t_end = now - days * 86400, now - 3600
+            expected = RestAdapter({"protocol": "http", "domain": "localhost", "port": stub.port}).query(t_start, t_end)
+            batches = list(RestAdapter({"protocol": "http", "domain": "localhost", "port": stub.port})
+                           .query_batches(t_start, t_end, batch_size=100))
+            if days * 86400 > RestAdapter.stream_threshold:
+                assert len(batches) > 1 and all(len(batch) <= 100 for batch in batches)
+            else:
+                assert len(batches) == 1
+            readings = Readings.concatenate(batches)
+            assert len(expected) > 0
+            assert np.array_equal(readings.timestamps, expected.timestamps)
+            assert np.array_equal(readings.glucose, expected.glucose)
+    finally:
+        stub.stop()
+
+
+
+def check_mage():
+    """MAGE of a synthetic series with excursions of 100 mg/dl interrupted by small swings"""
+    import numpy as np
+    import pandas as pd
+    from cgm import GlycemicVariability, excursion_amplitudes
+    from database import DATETIME_COLUMN, GLUCOSE_COLUMN
+
+    assert excursion_amplitudes(np.array([100, 150, 140, 200, 100]), 30).tolist() == [100, 100]
+    assert excursion_amplitudes(np.array([120, 100, 200, 190, 195, 90]), 30).tolist() == [100, 110]
+    assert len(excursion_amplitudes(np.array([100, 110, 105]), 30)) == 0
+
+    '#readings every 5 minutes: a rise from 100 to 200 pausing at 150 after a dip to 140, and a fall back to 100'
+    ramp = lambda start, end, n: np.linspace(start, end, n, endpoint=False)
+    hold = lambda value: np.full(18, float(value))
+    cycle = np.concatenate([hold(100), ramp(100, 150, 12), hold(150), ramp(150, 140, 6), hold(140),
+                            ramp(140, 200, 12), hold(200), ramp(200, 100, 24)])
+    glucose = np.tile(cycle, 10)
+    times = pd.Timestamp("2020-01-01") + pd.to_timedelta(np.arange(len(glucose)) * 5, unit="min")
+    variability = GlycemicVariability()
+    variability.update(pd.DataFrame({DATETIME_COLUMN: times, GLUCOSE_COLUMN: glucose}), DATETIME_COLUMN, GLUCOSE_COLUMN)
+    result = variability.window(times[0].date())
+    assert result["sd"] < 50
+    assert np.isclose(result["mage"], 100), result["mage"]
+
+
+if __name__ == '__main__':
+    for check in [check_mongo_tailing, check_variability_incremental, check_composite_merge, check_rest_conditional,
+                  check_json_stream, check_rest_batches, check_mage]:
+        check()
+        print("{}: ok".format(check.__name__))
@@ -1,11 +1,30 @@
 import logging
+import threading
+import time
 import pandas as pd
+from dateutil.tz import tzlocal
+from readings import Readings
+import metrics
+from profiler import profiled
 from datetime import datetime, timedelta, timezone
 
 DATETIME_COLUMN = "datetime"
 GLUCOSE_COLUMN = "glucose"
 
 
+def to_frame(readings):
+    """
+    :param readings: Readings, or a list of tuples (datetime, glucose value) of legacy adapters
+    :return: DataFrame with DATETIME_COLUMN and GLUCOSE_COLUMN
+    """
+    if not isinstance(readings, Readings):
+        readings = Readings.from_tuples(readings)
+    '#Right now, the datetime objects are not carrying timezone information'
+    'the timestamps are converted to naive local time just like datetime.fromtimestamp'
+    datetimes = pd.to_datetime(readings.timestamps, unit="ms").tz_localize("UTC").tz_convert(tzlocal()).tz_localize(None)
+    return pd.DataFrame({DATETIME_COLUMN: datetimes, GLUCOSE_COLUMN: readings.glucose})
+
+
 class DataBase:
     def __init__(self, adapter):
 
@@ -15,6 +34,46 @@ class DataBase:
         self.latest_query_time = -1
         self.df = pd.DataFrame(columns=[DATETIME_COLUMN, GLUCOSE_COLUMN])
         self.adapter = adapter
+        '#guards self.df, readings are pushed from the adapter thread while tailing'
+        self.lock = threading.Lock()
+        '#incremented with every merge, lets the dashboard refresh as soon as readings were pushed'
+        self.version = 0
+
+    def start_tailing(self):
+        """
+        Lets the adapter push new readings as they arrive, the one minute query interval of get_entries is
+        skipped while the adapter is tailing.
+        :return: False if the adapter does not support tailing
+        """
+        return self.adapter.start_tailing(self.push_entries)
+
+    def push_entries(self, readings):
+        latest = self.merge([to_frame(readings)])
+        metrics.DATABASE_PUSHED_ROWS.inc(len(readings))
+        '#before the history is loaded, moving the query time would skip the initial query'
+        if self.earlierst_query_time != -1:
+            self.latest_query_time = max(self.latest_query_time, latest)
+
+    def merge(self, frames):
+        """
+        :param frames: List of DataFrames as returned by to_frame
+        :return: timestamp of the latest merged reading
+        """
+        with metrics.DATABASE_MERGE_SECONDS.time():
+            temp_df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+            with self.lock:
+                if len(self.df) == 0:
+                    self.df = temp_df.drop_duplicates()
+                else:
+                    self.df = pd.concat([self.df, temp_df], sort=False, ignore_index=True).drop_duplicates()
+                self.version += 1
+
+        'make sure to use .to_pydatetime() to calculate timestamp'
+        'calling .timestamp() within pandas directly will wrongly give a wront timestamp' \
+        'it wrongly uses the local time of the object as utc time' \
+        'example: datetime object (10:00 local time (+1h)), pandas will give a timestamp +3600 seconds later ' \
+        'which would be 10:00 in utc and 11:00 in local time'
+        return temp_df[DATETIME_COLUMN].max().to_pydatetime().timestamp() #utc
 
     def update_entries(self, start_datetime=None):
         """
@@ -42,30 +101,37 @@ class DataBase:
         self.logger.info("querying: {} - {}".format(datetime.fromtimestamp(t_start).strftime(fmt),
                                                     datetime.fromtimestamp(t_end).strftime(fmt)))
 
+        adapter_name = type(self.adapter).__name__
         try:
-            tuples = self.adapter.query(t_start, t_end)
-            if len(tuples) > 0:
-                self.logger.info("queried {} new entries".format(len(tuples)))
-
-                '#Right now, the datetime objects are not carrying timezone information'
-                temp_df = pd.DataFrame(data=tuples, columns=[DATETIME_COLUMN, GLUCOSE_COLUMN])
-                self.df = self.df.append(temp_df, sort=False, ignore_index=True).drop_duplicates()
-
-                'make sure to use .to_pydatetime() to calculate timestamp'
-                'calling .timestamp() within pandas directly will wrongly give a wront timestamp' \
-                'it wrongly uses the local time of the object as utc time' \
-                'example: datetime object (10:00 local time (+1h)), pandas will give a timestamp +3600 seconds later ' \
-                'which would be 10:00 in utc and 11:00 in local time'
-                t, g = zip(*tuples)
-                datetime_latest_queried_item = temp_df[DATETIME_COLUMN].max().to_pydatetime().timestamp() #utc
+            '#batches are converted to compact frames as they arrive, only the fetching is timed'
+            frames, fetch_seconds = [], 0
+            batches = self.adapter.query_batches(t_start, t_end)
+            while True:
+                t = time.perf_counter()
+                batch = next(batches, None)
+                fetch_seconds += time.perf_counter() - t
+                if batch is None:
+                    break
+                frame = to_frame(batch)
+                if len(frame) > 0:
+                    frames.append(frame)
+            rows = sum(len(frame) for frame in frames)
+            metrics.ADAPTER_FETCH_SECONDS.observe(fetch_seconds, adapter_name)
+            metrics.ADAPTER_FETCH_ROWS.observe(rows, adapter_name)
+            if rows > 0:
+                self.logger.info("queried {} new entries".format(rows))
+                datetime_latest_queried_item = self.merge(frames)
             else:
                 self.logger.info("didn't find any new entries")
 
 
         except Exception as e:
+            metrics.ADAPTER_FETCH_ERRORS.inc(labels=adapter_name)
             self.logger.error("Error while querying for last entries: \n {}".format(e))
             return False
         else:
+            '#the readings are stored, the adapter may skip them from now on'
+            self.adapter.commit()
             '#update query times (only if query returned results)'
             'we can not be sure that the database is fast enough to return values once they are imported'
             'therefore end-time is only updated if we received a new value'
@@ -74,15 +140,22 @@ class DataBase:
             self.latest_query_time = datetime_latest_queried_item
             return True
 
+    @profiled()
     def get_entries(self, start_datetime, update=True, reload=False):
 
         '#check if we need to update data'
-        if reload or (update and (((datetime.now().timestamp()-self.latest_query_time) > 1*60) or (start_datetime.timestamp() < self.earlierst_query_time))):
+        '#while tailing, new readings are pushed and only the initial history or older data is queried'
+        stale = ((datetime.now().timestamp()-self.latest_query_time) > 1*60) and not self.adapter.is_tailing()
+        if reload or (update and (stale or (self.earlierst_query_time == -1) or (start_datetime.timestamp() < self.earlierst_query_time))):
+            metrics.DATABASE_CACHE_MISSES.inc()
             success = self.update_entries(start_datetime)
             if not success:
                 return None
+        else:
+            metrics.DATABASE_CACHE_HITS.inc()
 
-        sub_frame = self.df.loc[self.df[DATETIME_COLUMN] > start_datetime].sort_values(DATETIME_COLUMN)
+        df = self.df
+        sub_frame = df.loc[df[DATETIME_COLUMN] > start_datetime].sort_values(DATETIME_COLUMN)
         if len(sub_frame) > 0:
             return sub_frame.copy()
         else:
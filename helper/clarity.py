@@ -2,7 +2,6 @@ import pandas as pd
 from datetime import datetime, timedelta
 import os
 import glob
-from matplotlib import pyplot as plt
 
 def convert(x, low_description='Niedrig'):
     try:
@@ -64,6 +63,7 @@ def load_clarity_csvs_from(path_names, visualize=False):
         dfs.append(temp)
 
     if visualize:
+        from matplotlib import pyplot as plt
         plt.figure(figsize=(15, 4))
         plt.title("start/end of cgm data in csv files")
         for temp in dfs:
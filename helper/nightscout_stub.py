@@ -0,0 +1,110 @@
+"""
+Local stand-in for the nightscout REST api, serving /api/v1/entries/sgv.json from the offline adapter.
+Like nightscout (express), responses carry an ETag of the body and requests with a matching
+If-None-Match are answered with 304 not modified.
+
+Run from the repository root
+>python -m helper.nightscout_stub 1337
+
+and point the REST config at it
+>[REST]
+>protocol = http
+>domain = localhost
+>port = 1337
+"""
+import hashlib
+import json
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+from adapter import OfflineAdapter
+
+ENTRIES_PATH = "/api/v1/entries/sgv.json"
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class NightscoutStub:
+    def __init__(self, adapter=None, port=1337, history_days=365):
+        self.adapter = OfflineAdapter() if adapter is None else adapter
+        self.history_days = history_days
+        self.server = ThreadingHTTPServer(("localhost", port), self.handler())
+        self.port = self.server.server_address[1]
+        '#number of requests and bytes sent, by status code'
+        self.requests = {}
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+    def entries(self, query):
+        """entries in nightscout format, newest first"""
+        t_now = time.time()
+        t_start = float(query.get("find[date][$gt]", [(t_now - self.history_days * 24 * 3600) * 1000])[0]) / 1000
+        t_end = float(query.get("find[date][$lt]", [t_now * 1000])[0]) / 1000
+        count = int(query.get("count", [10])[0])
+        readings = self.adapter.query(t_start, min(t_end, t_now)).sorted()
+        readings = readings[(readings.timestamps > t_start * 1000) & (readings.timestamps < t_end * 1000)][::-1]
+        return [{"date": date, "sgv": sgv, "type": "sgv"}
+                for date, sgv in zip(readings.timestamps[:count].tolist(), readings.glucose[:count].tolist())]
+
+    def count(self, status, size):
+        with self.lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+            self.bytes_sent += size
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != ENTRIES_PATH:
+                    self.send_error(404)
+                    stub.count(404, 0)
+                    return
+                entries = stub.entries(parse_qs(url.query))
+                body = json.dumps(entries).encode("utf-8")
+                etag = 'W/"{}"'.format(hashlib.sha1(body).hexdigest())
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    stub.count(304, 0)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                if len(entries) > 0:
+                    self.send_header("Last-Modified", formatdate(entries[0]["date"] / 1000, usegmt=True))
+                self.end_headers()
+                self.wfile.write(body)
+                stub.count(200, len(body))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """serves in a background thread"""
+        thread = threading.Thread(target=self.server.serve_forever, name="nightscout-stub", daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1337
+    stub = NightscoutStub(port=port)
+    print("serving http://localhost:{}{}".format(stub.port, ENTRIES_PATH))
+    stub.server.serve_forever()
@@ -0,0 +1,215 @@
+"""
+Load test simulating many dashboards polling one server, run from the repository root
+>python loadtest.py --clients 1,5,10,20 --duration 30
+
+Starts app.py on the OFFLINE adapter, or with --backend rest on the local nightscout stub, in a temporary
+directory. Each client loads the dashboard like a browser does and then sends the one minute interval ticks,
+compressed to --tick seconds, occasionally changing the slider or a checkbox. Reported per number of clients
+are throughput, callback latency percentiles, errors as well as cpu usage and peak memory of the server.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmark import ROOT
+
+CALLBACK_OUTPUT = "..top_graph.figure...last_loaded_div.children...title.children...rendered_version.data.."
+CALLBACK_OUTPUTS = [{"id": "top_graph", "property": "figure"},
+                    {"id": "last_loaded_div", "property": "children"},
+                    {"id": "title", "property": "children"},
+                    {"id": "rendered_version", "property": "data"}]
+CHECKBOXES = ["show_today", "show_days", "is_centered", "show_grid"]
+
+
+def callback_body(state, changed):
+    """request body of refresh_agp_graph_callback, as sent by the dash renderer"""
+    return {"output": CALLBACK_OUTPUT,
+            "outputs": CALLBACK_OUTPUTS,
+            "inputs": [{"id": "update_agp_interval", "property": "n_intervals", "value": state["ticks"]},
+                       {"id": "startup_interval", "property": "n_intervals", "value": 1},
+                       {"id": "checkboxes", "property": "value", "value": state["checkboxes"]},
+                       {"id": "day_slider", "property": "value", "value": state["slider"]},
+                       {"id": "data_version", "property": "data", "value": None}],
+            "changedPropIds": [changed],
+            "state": []}
+
+
+class Client(threading.Thread):
+    def __init__(self, url, tick, change_probability, stop, seed):
+        super().__init__(daemon=True)
+        self.url = url
+        self.tick = tick
+        self.change_probability = change_probability
+        self.stop = stop
+        self.random = random.Random(seed)
+        '#tuples (latency [s], http status or exception name, response bytes)'
+        self.results = []
+
+    def request(self, session, state, changed):
+        t = time.perf_counter()
+        try:
+            response = session.post(self.url + "/_dash-update-component", json=callback_body(state, changed),
+                                    headers={"Accept-Encoding": "gzip"}, timeout=60)
+            self.results.append((time.perf_counter() - t, response.status_code,
+                                 int(response.headers.get("Content-Length", len(response.content)))))
+        except requests.exceptions.RequestException as e:
+            self.results.append((time.perf_counter() - t, type(e).__name__, 0))
+
+    def run(self):
+        session = requests.Session()
+        state = {"ticks": 0, "slider": 2, "checkboxes": ["show_today", "is_centered", "show_grid"]}
+        session.get(self.url + "/")
+        self.request(session, state, "startup_interval.n_intervals")
+        '#clients start at random offsets within one tick, like tablets switched on at different times'
+        next_tick = time.time() + self.random.random() * self.tick
+        while not self.stop.is_set():
+            if self.random.random() < self.change_probability:
+                if self.random.random() < 0.5:
+                    state["slider"] = self.random.randint(1, 5)
+                    self.request(session, state, "day_slider.value")
+                else:
+                    checkbox = self.random.choice(CHECKBOXES)
+                    state["checkboxes"] = [c for c in state["checkboxes"] if c != checkbox] \
+                        if checkbox in state["checkboxes"] else state["checkboxes"] + [checkbox]
+                    self.request(session, state, "checkboxes.value")
+            self.stop.wait(max(0, next_tick - time.time()))
+            if self.stop.is_set():
+                break
+            state["ticks"] += 1
+            self.request(session, state, "update_agp_interval.n_intervals")
+            next_tick += self.tick
+
+
+class ProcessMonitor(threading.Thread):
+    """samples cpu time and resident memory of a process from /proc (linux only)"""
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.running = True
+
+    def cpu_seconds(self):
+        with open("/proc/{}/stat".format(self.pid)) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss(self):
+        with open("/proc/{}/status".format(self.pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def run(self):
+        while self.running:
+            self.peak_rss = max(self.peak_rss, self.rss())
+            time.sleep(self.interval)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if len(values) == 0:
+        return float("nan")
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_level(url, clients, duration, tick, change_probability, pid):
+    stop = threading.Event()
+    workers = [Client(url, tick, change_probability, stop, seed=i) for i in range(clients)]
+    monitor = ProcessMonitor(pid) if os.path.exists("/proc/{}/stat".format(pid)) else None
+    cpu_start = monitor.cpu_seconds() if monitor else None
+    if monitor:
+        monitor.start()
+    t = time.time()
+    for worker in workers:
+        worker.start()
+    time.sleep(duration)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - t
+
+    results = [r for worker in workers for r in worker.results]
+    latencies = [latency for latency, status, size in results if status == 200]
+    report = {"clients": clients,
+              "requests": len(results),
+              "errors": len(results) - len(latencies),
+              "throughput": len(results) / elapsed,
+              "p50": percentile(latencies, 50),
+              "p95": percentile(latencies, 95),
+              "p99": percentile(latencies, 99),
+              "bytes": sum(size for _, _, size in results) / max(len(results), 1)}
+    if monitor:
+        monitor.running = False
+        report["cpu"] = 100 * (monitor.cpu_seconds() - cpu_start) / elapsed
+        report["rss"] = monitor.peak_rss / 2 ** 20
+    return report
+
+
+def start_server(backend, port):
+    """:return: (server process, stub or None)"""
+    cwd = tempfile.mkdtemp(prefix="cgm-dash-load-")
+    stub = None
+    with open(os.path.join(cwd, "config.ini"), "w") as f:
+        if backend == "rest":
+            from helper.nightscout_stub import NightscoutStub
+            stub = NightscoutStub(port=0).start()
+            f.write("[REST]\nprotocol = http\ndomain = localhost\nport = {}\n".format(stub.port))
+        else:
+            f.write("[OFFLINE]\n")
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "app.py"), "-port={}".format(port)], cwd=cwd,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = "http://localhost:{}".format(port)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(url + "/", timeout=1).status_code == 200:
+                return process, stub
+        except requests.exceptions.RequestException:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("app.py did not start on port {}".format(port))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", default="1,5,10,20", help="comma separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per number of clients")
+    parser.add_argument("--tick", type=float, default=5, help="seconds between interval ticks of each client")
+    parser.add_argument("--change-probability", type=float, default=0.1,
+                        help="probability of a slider or checkbox change per tick")
+    parser.add_argument("--backend", choices=["offline", "rest"], default="offline")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--url", help="test an already running server instead of starting one")
+    args = parser.parse_args()
+
+    process, stub = (None, None) if args.url else start_server(args.backend, args.port)
+    url = args.url or "http://localhost:{}".format(args.port)
+    try:
+        print("{:>7} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8} {:>9} {:>6} {:>8}".format(
+            "clients", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "kB/resp", "cpu %", "rss MB"))
+        for clients in [int(c) for c in args.clients.split(",")]:
+            r = run_level(url, clients, args.duration, args.tick, args.change_probability,
+                          process.pid if process else -1)
+            print("{:7d} {:8d} {:6d} {:8.2f} {:8.1f} {:8.1f} {:8.1f} {:9.1f} {:>6} {:>8}".format(
+                r["clients"], r["requests"], r["errors"], r["throughput"],
+                r["p50"] * 1e3, r["p95"] * 1e3, r["p99"] * 1e3, r["bytes"] / 1024,
+                "{:.0f}".format(r["cpu"]) if "cpu" in r else "n/a",
+                "{:.0f}".format(r["rss"]) if "rss" in r else "n/a"))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        if stub:
+            stub.stop()
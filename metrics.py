@@ -0,0 +1,156 @@
+"""
+Lightweight prometheus style metrics. Values are kept in memory and served in the
+prometheus text format by the /metrics route of app.py.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (1000, 10000, 50000, 100000, 250000, 500000, 1000000, 5000000)
+
+REGISTRY = []
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        labels = (labels,) if isinstance(labels, str) else tuple(labels)
+        assert len(labels) == len(self.labelnames), "{} expects labels {}".format(self.name, self.labelnames)
+        return labels
+
+    def format_labels(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if len(pairs) == 0:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs) + "}"
+
+    def samples(self):
+        """:return: List of tuples (name suffix, labels string, value)"""
+        with self.lock:
+            return [("", self.format_labels(labels), value) for labels, value in self.values.items()]
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        lines += ["{}{}{} {}".format(self.name, suffix, labels, format_value(value))
+                  for suffix, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if len(self.labelnames) == 0:
+            self.values[()] = 0
+
+    def inc(self, amount=1, labels=()):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.functions = {}
+
+    def set(self, value, labels=()):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, fun, labels=()):
+        """fun is called whenever the metrics are scraped"""
+        key = self.key(labels)
+        with self.lock:
+            self.functions[key] = fun
+
+    def samples(self):
+        with self.lock:
+            functions = list(self.functions.items())
+        return super().samples() + [("", self.format_labels(labels), fun()) for labels, fun in functions]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, labels=()):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, labels=()):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for labels, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(("_bucket", self.format_labels(labels, [("le", format_value(bound))]), cumulative))
+                samples.append(("_sum", self.format_labels(labels), total))
+                samples.append(("_count", self.format_labels(labels), count))
+        return samples
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition():
+    """all registered metrics in the prometheus text format"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+ADAPTER_FETCH_SECONDS = Histogram("cgm_adapter_fetch_seconds", "Latency of adapter queries.", ["adapter"])
+ADAPTER_FETCH_ROWS = Histogram("cgm_adapter_fetch_rows", "Readings returned per adapter query.", ["adapter"],
+                               buckets=ROW_BUCKETS)
+ADAPTER_FETCH_ERRORS = Counter("cgm_adapter_fetch_errors_total", "Failed adapter queries.", ["adapter"])
+DATABASE_MERGE_SECONDS = Histogram("cgm_database_merge_seconds", "Time to merge queried readings into the history.")
+DATABASE_PUSHED_ROWS = Counter("cgm_database_pushed_rows_total", "Readings pushed by tailing adapters.")
+DATABASE_CACHE_HITS = Counter("cgm_database_cache_hits_total", "Entry requests served without querying the adapter.")
+DATABASE_CACHE_MISSES = Counter("cgm_database_cache_misses_total", "Entry requests that queried the adapter.")
+DATABASE_HISTORY_ROWS = Gauge("cgm_database_history_rows", "Readings held in memory.")
+DATA_STALENESS_SECONDS = Gauge("cgm_data_staleness_seconds", "Age of the most recent reading.")
+STAGE_SECONDS = Histogram("cgm_stage_seconds", "Time spent per processing stage of a refresh.", ["stage"])
+CALLBACK_RESPONSE_BYTES = Histogram("cgm_callback_response_bytes", "Uncompressed size of callback responses.",
+                                    buckets=BYTE_BUCKETS)
+CALLBACK_RESPONSE_WIRE_BYTES = Histogram("cgm_callback_response_wire_bytes",
+                                         "Size of callback responses as sent, after compression.",
+                                         buckets=BYTE_BUCKETS)
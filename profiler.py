@@ -0,0 +1,108 @@
+"""
+Opt-in sampling profiler for the refresh hot path. Start app.py with -profile to sample the stacks of
+all threads running a function decorated with profiled. Samples are grouped by the key of the outermost
+profiled call, i.e. one group per slider setting, and periodically written as collapsed stacks to
+profiles/<key>.folded. These can be rendered by flamegraph.pl or loaded into speedscope.
+"""
+import collections
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+profiler = None
+
+
+class SamplingProfiler:
+    def __init__(self, directory="profiles", interval=0.01, dump_interval=60):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.lock = threading.Lock()
+        '#thread id -> keys of the profiled calls currently running in that thread, outermost first'
+        self.active = {}
+        '#key -> Counter(collapsed stack -> number of samples)'
+        self.stacks = collections.defaultdict(collections.Counter)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        thread.start()
+        self.logger.warning("sampling every {}s, writing stacks to {}".format(self.interval,
+                                                                             os.path.abspath(self.directory)))
+
+    def run(self):
+        last_dump = time.time()
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+            if time.time() - last_dump > self.dump_interval:
+                self.dump()
+                last_dump = time.time()
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self.lock:
+            for thread_id, keys in self.active.items():
+                if thread_id in frames:
+                    self.stacks[keys[0]][collapse(frames[thread_id])] += 1
+
+    def enter(self, key):
+        with self.lock:
+            self.active.setdefault(threading.get_ident(), []).append(key)
+
+    def exit(self):
+        thread_id = threading.get_ident()
+        with self.lock:
+            keys = self.active[thread_id]
+            keys.pop()
+            if len(keys) == 0:
+                del self.active[thread_id]
+
+    def dump(self):
+        """overwrites profiles/<key>.folded with all samples collected since startup"""
+        with self.lock:
+            snapshot = {key: list(stacks.items()) for key, stacks in self.stacks.items()}
+        os.makedirs(self.directory, exist_ok=True)
+        for key, stacks in snapshot.items():
+            path = os.path.join(self.directory, "{}.folded".format(key))
+            with open(path, "w") as f:
+                f.writelines("{} {}\n".format(stack, count) for stack, count in stacks)
+
+
+def collapse(frame):
+    """collapsed stack notation, callers first and separated by semicolons"""
+    names = []
+    while frame is not None:
+        names.append("{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def enable(directory="profiles", interval=0.01, dump_interval=60):
+    global profiler
+    profiler = SamplingProfiler(directory, interval, dump_interval)
+    profiler.start()
+
+
+def profiled(key=None):
+    """
+    Decorates functions whose stacks are sampled while profiling is enabled. Without profiling enabled
+    the overhead is a single check per call.
+    :param key: name of the sample group or function computing it from the call arguments,
+                defaults to the function name
+    """
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            if profiler is None:
+                return fun(*args, **kwargs)
+            profiler.enter(key(*args, **kwargs) if callable(key) else (key or fun.__name__))
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                profiler.exit()
+        return wrapper
+    return decorator
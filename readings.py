@@ -0,0 +1,72 @@
+import numpy as np
+from datetime import datetime
+
+
+class Readings:
+    """
+    Glucose readings as returned by the adapters. Readings are stored in parallel numpy arrays,
+    epoch timestamps [ms] as int64 and glucose [mg/dl] as int16, about 10 bytes per reading instead of
+    the ~150 bytes of a tuple (datetime, glucose value).
+    Slicing returns views without copying, iterating yields the tuples (datetime, glucose value)
+    returned by the adapters before.
+    """
+    __slots__ = ("timestamps", "glucose", "trends", "source")
+
+    def __init__(self, timestamps=(), glucose=(), trends=None, source=None):
+        """
+        :param timestamps: epoch timestamps [ms]
+        :param glucose: glucose values [mg/dl], rounded if not integer
+        :param trends: optional trend arrows as dexcom trend codes (1 double up ... 7 double down)
+        :param source: optional name of the adapter the readings were queried from
+        """
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        glucose = np.asarray(glucose)
+        self.glucose = glucose if glucose.dtype == np.int16 else np.round(glucose).astype(np.int16)
+        self.trends = None if trends is None else np.asarray(trends, dtype=np.int8)
+        self.source = source
+        assert len(self.timestamps) == len(self.glucose), "timestamps and glucose differ in length"
+
+    @classmethod
+    def from_tuples(cls, tuples, source=None):
+        """:param tuples: List of tuples (datetime, glucose value)"""
+        timestamps = np.fromiter((t.timestamp() * 1000 for t, g in tuples), dtype=np.float64, count=len(tuples))
+        glucose = np.fromiter((g for t, g in tuples), dtype=np.float64, count=len(tuples))
+        return cls(np.round(timestamps), glucose, source=source)
+
+    @classmethod
+    def concatenate(cls, readings, source=None):
+        """joins several Readings into one, allocating each array once"""
+        readings = list(readings)
+        trends = None
+        if any(r.trends is not None for r in readings):
+            trends = np.concatenate([r.trends if r.trends is not None else np.zeros(len(r), np.int8)
+                                     for r in readings])
+        return cls(np.concatenate([r.timestamps for r in readings] + [np.empty(0, np.int64)]),
+                   np.concatenate([r.glucose for r in readings] + [np.empty(0, np.int16)]),
+                   trends, source)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, item):
+        """slices are views, boolean masks and index arrays copy"""
+        return Readings(self.timestamps[item], self.glucose[item],
+                        None if self.trends is None else self.trends[item], self.source)
+
+    def __iter__(self):
+        for t, g in zip(self.timestamps.tolist(), self.glucose.tolist()):
+            yield datetime.fromtimestamp(t / 1000), g
+
+    def __repr__(self):
+        return "Readings({} readings{})".format(len(self), "" if self.source is None else " from " + self.source)
+
+    def between(self, t_start, t_end):
+        """readings with t_start <= timestamp <= t_end, both given in posix seconds"""
+        return self[(self.timestamps >= t_start * 1000) & (self.timestamps <= t_end * 1000)]
+
+    def sorted(self):
+        return self if np.all(np.diff(self.timestamps) >= 0) else self[np.argsort(self.timestamps, kind="stable")]
+
+    def newest(self):
+        """timestamp [ms] of the newest reading, None if empty"""
+        return int(self.timestamps.max()) if len(self) > 0 else None
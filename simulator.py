@@ -0,0 +1,104 @@
+"""
+Deterministic CGM simulator backing the OfflineAdapter. Every reading is a pure function of
+(seed, patient, timestamp), computed with numpy over whole arrays, so overlapping or repeated
+queries return identical data and years of readings for many patients can be generated without
+a backend.
+
+The glucose model adds up
+ - a patient specific basal level with a day to day drift
+ - a dawn phenomenon in the early morning and occasional nocturnal lows
+ - breakfast, lunch and dinner at jittered times with varying size, occasionally skipped
+ - slow sensor wobble and white noise
+and is clipped to the sensor range, 40 (Low) to 400 (High) mg/dl. Sensor gaps of up to a few hours
+and single dropped readings are removed from the result.
+"""
+import numpy as np
+
+LOW = 40
+HIGH = 400
+
+MEAL_HOURS = np.array([7.5, 12.5, 19.0])
+MEAL_PEAK_HOURS = 1.0
+
+'#dexcom trend codes, by lower bound of the rate of change in mg/dl/min'
+TREND_BOUNDS = np.array([-3, -2, -1, 1, 2, 3])
+TREND_CODES = np.array([7, 6, 5, 4, 3, 2, 1])
+
+
+def mix(x):
+    """splitmix64 finalizer on uint64 arrays"""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def uniform(*keys):
+    """deterministic uniform numbers in [0, 1) hashed from integer keys, arrays are broadcast"""
+    x = np.uint64(0x9E3779B97F4A7C15)
+    with np.errstate(over="ignore"):
+        for key in keys:
+            x = mix(x ^ np.asarray(key, dtype=np.int64).view(np.uint64) + np.uint64(0x9E3779B97F4A7C15))
+    return (x >> np.uint64(11)).astype(np.float64) / float(2 ** 53)
+
+
+def normal(*keys):
+    """deterministic standard normal numbers, Box-Muller on two hashed uniforms"""
+    u1, u2 = uniform(*keys, 1), uniform(*keys, 2)
+    return np.sqrt(-2 * np.log1p(-u1)) * np.cos(2 * np.pi * u2)
+
+
+def meal_response(hours):
+    """glucose rise relative to its peak, hours after a meal"""
+    hours = np.maximum(hours, 0)
+    return hours / MEAL_PEAK_HOURS * np.exp(1 - hours / MEAL_PEAK_HOURS)
+
+
+def glucose(timestamps, utc_offsets, seed=0, patient=0, noise=4.0):
+    """
+    :param timestamps: posix timestamps [s] as int64 array
+    :param utc_offsets: offset of local time to utc [s] per timestamp, meals and nights follow local time
+    :return: glucose [mg/dl] as float array, clipped to the sensor range
+    """
+    local = timestamps + utc_offsets
+    days = local // 86400
+    hours = (local % 86400) / 3600
+
+    basal = 110 + 40 * (uniform(seed, patient, 0) - 0.5) + 15 * normal(seed, patient, days, 1)
+    dawn = 25 * np.exp(-((hours - 6) / 1.5) ** 2)
+    night_low = -55 * (uniform(seed, patient, days, 2) < 0.15) * np.exp(-((hours - 3) / 1.0) ** 2)
+
+    '#meals of the same and the previous day, whose dinner still affects the night'
+    meals = 0
+    for day_shift in (0, 1):
+        meal_days = (days - day_shift)[:, None]
+        meal_ids = np.arange(len(MEAL_HOURS))[None, :]
+        meal_hours = MEAL_HOURS + (uniform(seed, patient, meal_days, meal_ids, 3) - 0.5) * 2
+        size = 40 + 90 * uniform(seed, patient, meal_days, meal_ids, 4)
+        eaten = uniform(seed, patient, meal_days, meal_ids, 5) > 0.1
+        since_meal = hours[:, None] + 24 * day_shift - meal_hours
+        meals = meals + np.sum(eaten * size * meal_response(since_meal), axis=1)
+
+    wobble = 10 * np.sin(2 * np.pi * (timestamps / (3 * 3600) + uniform(seed, patient, days, 6)))
+    white = noise * normal(seed, patient, timestamps, 7)
+    return np.clip(basal + dawn + night_low + meals + wobble + white, LOW, HIGH)
+
+
+def available(timestamps, utc_offsets, seed=0, patient=0, gap_probability=0.2, drop_probability=0.01):
+    """
+    :return: boolean mask of timestamps with a reading, False during sensor gaps and for dropped readings
+    """
+    local = timestamps + utc_offsets
+    days = local // 86400
+    hours = (local % 86400) / 3600
+    has_gap = uniform(seed, patient, days, 8) < gap_probability
+    gap_start = 24 * uniform(seed, patient, days, 9)
+    gap_length = 0.5 + 3.5 * uniform(seed, patient, days, 10)
+    in_gap = has_gap & (hours >= gap_start) & (hours < gap_start + gap_length)
+    dropped = uniform(seed, patient, timestamps, 11) < drop_probability
+    return ~in_gap & ~dropped
+
+
+def trends(values, interval):
+    """dexcom trend codes from the change to the previous reading, values has one leading reading extra"""
+    rate = np.diff(values) / (interval / 60)
+    return TREND_CODES[np.searchsorted(TREND_BOUNDS, rate, side="right")]